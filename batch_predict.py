@@ -0,0 +1,222 @@
+"""
+### Overview: Predicts the number of additional scans needed for many samples at once, such as a night's worth of
+queued samples. The hdf5 files found in the given directories or globs are grouped by the sample their scans are from,
+and each sample is predicted on its own worker process. A sample that fails is reported with its error, and the rest of
+the batch carries on. If a worker dies, eg. from running out of memory, the samples it took down with it are predicted
+again on a fresh pool. One row is written per sample, to a CSV or JSON file.
+
+Usage:
+    python batch_predict.py /data/queued/ "/data/extra/*.hdf5" --output results.csv --workers 8 --memory-limit 4G###
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from instrumentation import StageRecorder
+from scan_index import default_index
+
+# The file extensions looked for when a directory is given.
+HDF5_EXTENSIONS = ('.hdf5', '.h5', '.nxs')
+# The columns of each result row, in the order they're written.
+RESULT_FIELDS = ('sample', 'files', 'num_scans', 'additional_scans', 'cut_off', 'cut_off_scan', 'error')
+# The number of pools a sample can be left unfinished in by another worker dying, before it's predicted on its own.
+SHARED_ATTEMPTS = 2
+
+
+def find_scan_files(paths):
+    """
+    Purpose: Lists the hdf5 files in a set of directories, globs and file names.
+    Parameters:
+        paths(list of str): directories (searched recursively for hdf5 files), glob patterns or file names.
+    Returns:
+        (list of str): the hdf5 files found, sorted and without duplicates.
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.update(os.path.join(root, name) for name in names if name.lower().endswith(HDF5_EXTENSIONS))
+        else:
+            files.update(glob.glob(path, recursive=True))
+    return sorted(files)
+
+
+def group_by_sample(files):
+    """
+    Purpose: Groups hdf5 files by the sample their scans are from, looking them up in the default ScanIndex, so only
+    files that are new or have changed since the last batch are opened.
+    Parameters:
+        files(list of str): the hdf5 files to group.
+    Returns:
+        groups(dict): the files of each sample, keyed by sample name, in the order the files were given. A file whose
+        scans are from more than one sample is grouped under its first sample, and is reported when it's validated.
+        unreadable(dict): the error message of each file that couldn't be read, keyed by file name.
+    """
+    return default_index().group_by_sample(files)
+
+
+def _limit_memory(max_bytes):
+    # Each worker's address space is capped, so a sample that needs too much memory fails with a MemoryError instead
+    # of taking the rest of the machine down with it.
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def _predict_sample(sample, files, percent_of_log, num_scans, timings=False, engine='sgmdata'):
+    row = {'sample': sample, 'files': len(files)}
+    recorder = StageRecorder(sample=sample) if timings else None
+    try:
+        from predict_num_scans import prediction_details
+        details = prediction_details(files, percent_of_log=percent_of_log, num_scans=num_scans, engine=engine,
+                                     recorder=recorder)
+        row.update({
+            'num_scans': details['num_scans'],
+            'additional_scans': int(details['additional_scans']),
+            'cut_off': float(details['cut_off']),
+            'cut_off_scan': int(details['cut_off_scan']),
+        })
+    except Exception as e:
+        row['error'] = "{}: {}".format(type(e).__name__, e)
+    if recorder:
+        row['stages'] = recorder.records
+    return row
+
+
+def _run_pool(samples, groups, workers, memory_limit, task_args):
+    # Predicts samples on a fresh pool. Returns the rows of the samples that finished, and the error of each sample
+    # left unfinished because a worker died and broke the pool.
+    rows = {}
+    broken = {}
+    initializer = _limit_memory if memory_limit else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=(memory_limit,) if memory_limit else ()) as pool:
+        futures = {sample: pool.submit(_predict_sample, sample, groups[sample], *task_args) for sample in samples}
+        for sample, future in futures.items():
+            try:
+                rows[sample] = future.result()
+            except BrokenProcessPool as e:
+                broken[sample] = e
+            except Exception as e:
+                rows[sample] = {'sample': sample, 'files': len(groups[sample]),
+                                'error': "{}: {}".format(type(e).__name__, e)}
+    return rows, broken
+
+
+def predict_batch(paths, workers=None, memory_limit=None, percent_of_log=0.4, num_scans=10, timings=False,
+                  engine='sgmdata'):
+    """
+    ### Description:
+    -----
+        Predicts the number of additional scans needed for every sample found in paths, one sample per worker process.
+    ### Args:
+    -----
+        > **paths** *(type: list of str)* -- Directories, glob patterns or file names of the hdf5 files to predict for.
+        > **workers** *(type: optional int)* -- The number of worker processes. Default is the number of CPUs.
+        > **memory_limit** *(type: optional int)* -- The most memory each worker can use, in bytes. Default is no limit.
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **num_scans** *(type: optional int)* -- Default value is 10. See predict_num_scans.
+        > **timings** *(type: optional boolean)* -- Default value is False. If set to True, each sample's prediction is
+            recorded with a StageRecorder, and its records are added to the sample's row under 'stages'.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". See check_sample_fitness.
+    ### Returns:
+    -----
+        >*(type: list of dicts)*: One row per sample, sorted by sample name, followed by one row per unreadable file.
+            Each row has the keys in RESULT_FIELDS; 'error' is only filled in if the prediction failed.
+    """
+    groups, unreadable = group_by_sample(find_scan_files(paths))
+    task_args = (percent_of_log, num_scans, timings, engine)
+    results = {}
+    attempts = dict.fromkeys(groups, 0)
+    pending = list(groups)
+    while pending:
+        # When a worker dies, eg. it was killed for running out of memory, every sample that hadn't finished fails with
+        # it, not only the one that was too big. Those samples are predicted again on a fresh pool, and once a sample
+        # has been caught up in SHARED_ATTEMPTS broken pools, it's predicted on a pool of its own, so if it's the one
+        # killing its worker, only it is reported as failed.
+        shared = [sample for sample in pending if attempts[sample] < SHARED_ATTEMPTS]
+        alone = [sample for sample in pending if attempts[sample] >= SHARED_ATTEMPTS]
+        pending = []
+        if shared:
+            rows, broken = _run_pool(shared, groups, workers, memory_limit, task_args)
+            results.update(rows)
+            for sample in broken:
+                attempts[sample] += 1
+                pending.append(sample)
+        for sample in alone:
+            rows, broken = _run_pool([sample], groups, 1, memory_limit, task_args)
+            results.update(rows)
+            for sample, e in broken.items():
+                results[sample] = {'sample': sample, 'files': len(groups[sample]),
+                                   'error': "{}: {}".format(type(e).__name__, e)}
+    rows = [results[sample] for sample in sorted(results, key=str)]
+    for filename, error in unreadable.items():
+        rows.append({'sample': None, 'files': 1, 'error': "{}: {}".format(filename, error)})
+    fields = RESULT_FIELDS + ('stages',) if timings else RESULT_FIELDS
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+
+def write_results(rows, output, output_format=None):
+    """
+    Purpose: Writes the rows returned by predict_batch to a file, or to stdout.
+    Parameters:
+        rows(list of dicts): the rows to write.
+        output(str): the file to write to, or "-" for stdout.
+        output_format(optional str): "csv" or "json". Default is taken from the output file's extension, or csv.
+    """
+    if output_format is None:
+        output_format = 'json' if output.lower().endswith('.json') else 'csv'
+    f = sys.stdout if output == '-' else open(output, 'w', newline='')
+    try:
+        if output_format == 'json':
+            json.dump(rows, f, indent=2)
+            f.write('\n')
+        else:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def parse_size(text):
+    """Reads a size such as 512M or 4G as a number of bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict the number of additional scans needed for many samples.")
+    parser.add_argument('paths', nargs='+', help="directories, glob patterns or hdf5 files")
+    parser.add_argument('-o', '--output', default='-', help="file to write results to (default: stdout)")
+    parser.add_argument('--format', choices=('csv', 'json'), help="output format (default: from the output file name)")
+    parser.add_argument('-w', '--workers', type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--memory-limit', type=parse_size, help="memory cap per worker, eg. 4G (default: none)")
+    parser.add_argument('--percent-of-log', type=float, default=0.4)
+    parser.add_argument('--num-scans', type=int, default=10)
+    parser.add_argument('--engine', choices=('sgmdata', 'native'), default='sgmdata',
+                        help="how scans are interpolated (default: sgmdata)")
+    parser.add_argument('--timings', help="file to append the time and memory taken by each stage to, as JSON lines")
+    args = parser.parse_args(argv)
+    rows = predict_batch(args.paths, workers=args.workers, memory_limit=args.memory_limit,
+                         percent_of_log=args.percent_of_log, num_scans=args.num_scans, timings=bool(args.timings),
+                         engine=args.engine)
+    write_results(rows, args.output, args.format)
+    if args.timings:
+        with open(args.timings, 'a') as f:
+            for row in rows:
+                for record in row.get('stages') or ():
+                    f.write(json.dumps(record, default=str) + '\n')
+    return 1 if any(row['error'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
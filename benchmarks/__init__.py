@@ -0,0 +1,10 @@
+"""
+### Overview: Benchmarks for the hot paths of the scan prediction: checking and interpolating a sample's scans, the
+running mean over the scans, determine_num_scans, lowest_variance and predict_num_scans from end to end. Each
+scenario is run on synthetic samples of 10 up to 1,000 scans written by synthetic_scans, and the timings are saved as
+JSON. Comparing a run against a saved baseline flags any scenario that has become slower.
+
+Usage:
+    python -m benchmarks --output bench.json
+    python -m benchmarks --baseline bench.json --output new.json###
+"""
@@ -0,0 +1,174 @@
+"""
+### Overview: Runs the benchmark scenarios on synthetic samples of each size, saves the timings as JSON and, if a
+baseline is given, reports the scenarios that have become slower than it. Exits with status 1 if any scenario has
+become slower, has gone over its time budget or couldn't be run.###
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.scenarios import BUDGETS, SCENARIOS, Fixture
+
+DEFAULT_SIZES = (10, 100, 1000)
+# How much slower than the baseline a scenario can get before it's reported, as a fraction.
+DEFAULT_TOLERANCE = 0.25
+
+
+def time_scenario(scenario, fixture, repeats):
+    """
+    Purpose: Times one scenario on one fixture.
+    Parameters:
+        scenario(function): the scenario to run.
+        fixture(Fixture): the sample to run it on.
+        repeats(int): the number of timed runs, after one untimed run to warm up.
+    Returns:
+        (dict): the 'min', 'median' and 'mean' of the runs in seconds, and the number of 'repeats', or the 'error' if
+        the scenario couldn't be run.
+    """
+    try:
+        scenario(fixture)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            scenario(fixture)
+            times.append(time.perf_counter() - start)
+    except Exception as e:
+        return {'error': "{}: {}".format(type(e).__name__, e)}
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times), 'repeats': repeats}
+
+
+def run(sizes=DEFAULT_SIZES, scenarios=None, repeats=5, data_dir=None, **fixture_kwargs):
+    """
+    Purpose: Runs the benchmark scenarios on a synthetic sample of each size.
+    Parameters:
+        sizes(optional list of ints): the numbers of scans in the samples. Default is DEFAULT_SIZES.
+        scenarios(optional list of str): the names of the scenarios to run. Default is all of SCENARIOS.
+        repeats(optional int): the number of timed runs of each scenario. Default value is 5.
+        data_dir(optional str): where to keep the synthetic samples, so later runs can reuse them. Default is a
+        temporary directory that's removed afterwards.
+        **fixture_kwargs: passed on to Fixture.
+    Returns:
+        (dict): the 'meta'data of the run and its 'results', one per scenario and size.
+    """
+    names = list(scenarios or SCENARIOS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            directory = os.path.join(data_dir or tmp, 'scans_{}'.format(size))
+            os.makedirs(directory, exist_ok=True)
+            fixture = Fixture(directory, size, **fixture_kwargs)
+            for name in names:
+                result = {'scenario': name, 'scans': size}
+                result.update(time_scenario(SCENARIOS[name], fixture, repeats))
+                results.append(result)
+                print("{:<32} {:>6} scans  {}".format(name, size, _describe(result)), flush=True)
+    meta = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'fixture': fixture_kwargs,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def _describe(result):
+    if 'error' in result:
+        return "error: " + result['error']
+    return "median {:.4f} s, min {:.4f} s".format(result['median'], result['min'])
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Purpose: Compares a run's results against a baseline run.
+    Parameters:
+        results(dict): the run, as returned by run.
+        baseline(dict): the baseline run, in the same form.
+        tolerance(optional float): how much slower than the baseline a scenario can get before it's reported, as a
+        fraction. Default is DEFAULT_TOLERANCE.
+    Returns:
+        (list of dicts): one per scenario and size of the run that either errored or is found in the baseline, with
+        the 'ratio' of the median times (above 1 is slower, None if it errored) and whether it's a 'regression'. A
+        scenario that errored is always a regression, and has the 'error' too.
+    """
+    before = {(r['scenario'], r['scans']): r for r in baseline['results'] if 'median' in r}
+    comparison = []
+    for result in results['results']:
+        row = {'scenario': result['scenario'], 'scans': result['scans']}
+        if 'error' in result:
+            row.update({'ratio': None, 'regression': True, 'error': result['error']})
+        else:
+            old = before.get((result['scenario'], result['scans']))
+            if old is None:
+                continue
+            ratio = result['median'] / old['median']
+            row.update({'ratio': ratio, 'regression': ratio > 1 + tolerance})
+        comparison.append(row)
+    return comparison
+
+
+def over_budget(results, budgets=BUDGETS):
+    """
+    Purpose: Finds the scenarios whose median time went over their time budget.
+    Parameters:
+        results(dict): the run, as returned by run.
+        budgets(optional dict): the longest each scenario may take, in seconds, keyed by scenario name. Default is
+        BUDGETS.
+    Returns:
+        (list of dicts): one per scenario and size over its budget, with its 'median' time and its 'budget'.
+    """
+    return [{'scenario': r['scenario'], 'scans': r['scans'], 'median': r['median'], 'budget': budgets[r['scenario']]}
+            for r in results['results'] if 'median' in r and r['median'] > budgets.get(r['scenario'], float('inf'))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the scan prediction.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="numbers of scans to run with")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--points', type=int, default=500, help="energy points per scan")
+    parser.add_argument('--channels', type=int, default=4, help="sdd signals per scan")
+    parser.add_argument('--bins', type=int, default=16, help="bins per sdd signal")
+    parser.add_argument('--noise-profile', default='constant', help="how the noise changes from scan to scan")
+    parser.add_argument('--data-dir', help="where to keep the synthetic samples (default: a temporary directory)")
+    parser.add_argument('-o', '--output', help="file to save the results to, as JSON")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction slower than the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.scenarios, args.repeats, args.data_dir, num_points=args.points,
+                  num_channels=args.channels, num_bins=args.bins, noise_profile=args.noise_profile)
+    failed = any('error' in result for result in results['results'])
+    results['over_budget'] = over_budget(results)
+    for row in results['over_budget']:
+        print("{:<32} {:>6} scans  median {:.4f} s over its {:.4f} s budget  OVER BUDGET".format(
+            row['scenario'], row['scans'], row['median'], row['budget']))
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = compare(results, json.load(f), args.tolerance)
+        results['comparison'] = comparison
+        for row in comparison:
+            if 'error' in row:
+                print("{:<32} {:>6} scans  error: {}  REGRESSION".format(row['scenario'], row['scans'], row['error']))
+            else:
+                print("{:<32} {:>6} scans  {:.2f}x baseline{}".format(row['scenario'], row['scans'], row['ratio'],
+                                                                      "  REGRESSION" if row['regression'] else ""))
+        failed = failed or any(row['regression'] for row in comparison)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+### Overview: The benchmark scenarios. Each one is a function taking a Fixture (a synthetic sample of a given number of
+scans, written once and shared by every scenario) and running the code being benchmarked once.###
+"""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+
+from native_interpolate import interpolate_scans
+from predict_num_scans import (check_sample_fitness, determine_num_scans, predict_num_scans, validate_scan_files)
+from scan_stats import accumulate_scans
+from synthetic_scans import write_sample
+
+# The command line whose start-up time is benchmarked.
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'predict_cli.py')
+# A desired_difference small enough that determine_num_scans has to search its whole forecast.
+BENCHMARK_DESIRED_DIFFERENCE = 1e-12
+
+
+class Fixture:
+    """
+    ### Description:
+    -----
+        A synthetic sample for the scenarios to run on, along with its interpolated scans and the differences between
+        them, worked out once.
+    ### Args:
+    -----
+        > **directory** *(type: str)* -- Where to write the sample's files. It must already exist.
+        > **num_scans** *(type: int)* -- The number of scans in the sample.
+        > **seed** *(type: optional int)* -- Default value is 0. The seed for the synthetic noise.
+        > ****kwargs** -- Passed on to synthetic_scans.write_sample, eg. num_points or num_channels.
+    """
+
+    def __init__(self, directory, num_scans, seed=0, **kwargs):
+        self.num_scans = num_scans
+        # Putting an outlier scan in every hundred, so the jump rule gets exercised.
+        outliers = range(50, num_scans, 100)
+        if not os.listdir(directory):
+            write_sample(directory, num_scans, seed=seed, outliers=outliers, **kwargs)
+        self.files = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+        self.report = validate_scan_files(self.files)
+        self.stack = interpolate_scans(self.report['scans'], self.report['sdd'])
+        self.diff_list, self.indices = accumulate_scans(self.stack.sdd())
+
+
+def check_sample_fitness_native(fixture):
+    check_sample_fitness(fixture.files, engine='native')
+
+
+def check_sample_fitness_sgmdata(fixture):
+    check_sample_fitness(fixture.files, cache=False)
+
+
+def interpolating_data(fixture):
+    from pns_testing import interpolating_data
+    interpolating_data(fixture.stack)
+
+
+def determine_num_scans_scenario(fixture):
+    try:
+        determine_num_scans(list(fixture.diff_list), fixture.indices, BENCHMARK_DESIRED_DIFFERENCE)
+    except (RuntimeError, ValueError):
+        # Not reaching the desired difference is expected; the whole forecast has still been searched.
+        pass
+
+
+def lowest_variance(fixture):
+    from pns_testing import lowest_variance
+    # lowest_variance prints every window's variance, which would swamp the timings.
+    with contextlib.redirect_stdout(io.StringIO()):
+        lowest_variance(fixture.diff_list)
+
+
+def predict_num_scans_scenario(fixture):
+    predict_num_scans(fixture.files, num_scans=fixture.num_scans, engine='native')
+
+
+def cli_help(fixture):
+    # The time to --help is the start-up cost every automation script pays, so it's kept under BUDGETS['cli_help']. It
+    # doesn't depend on the fixture.
+    subprocess.run([sys.executable, CLI, '--help'], check=True, stdout=subprocess.DEVNULL)
+
+
+SCENARIOS = {
+    'cli_help': cli_help,
+    'check_sample_fitness[native]': check_sample_fitness_native,
+    'check_sample_fitness[sgmdata]': check_sample_fitness_sgmdata,
+    'interpolating_data': interpolating_data,
+    'determine_num_scans': determine_num_scans_scenario,
+    'lowest_variance': lowest_variance,
+    'predict_num_scans[native]': predict_num_scans_scenario,
+}
+
+# The longest the median run of a scenario may take, in seconds, whatever the baseline says.
+BUDGETS = {
+    'cli_help': 0.3,
+}
@@ -0,0 +1,169 @@
+"""
+### Overview: Thins out the points of a plot before they reach bokeh, so a plot of hundreds of scans stays small enough
+for the browser and the notebook. Every plot gets a point budget, which is shared between its curves, and each curve is
+thinned to its share with a method that keeps the curve's shape: largest-triangle-three-buckets (LTTB), which keeps the
+points that stand out most from their neighbours, or min/max decimation, which keeps the lowest and highest point of
+each bucket so no peak or dip goes missing.###
+"""
+import numpy as np
+
+from scan_stack import ScanStack
+
+# The most points a plot is given if no budget is asked for.
+DEFAULT_POINT_BUDGET = 20000
+
+
+def lttb_indices(x, y, budget):
+    """
+    Purpose: Picks the points of a curve to keep with largest-triangle-three-buckets. The first and last points are
+    always kept, and the rest of the curve is split into budget - 2 buckets. From each bucket, the point kept is the one
+    making the largest triangle with the point kept from the bucket before and the average of the bucket after.
+    Parameters:
+        x(numpy array): the x values of the curve, in order.
+        y(numpy array): the y values of the curve.
+        budget(int): the number of points to keep.
+    Returns:
+        (numpy array): the positions of the points kept, in order.
+    """
+    n = len(x)
+    if budget >= n:
+        return np.arange(n)
+    if budget < 3:
+        return np.array([0, n - 1])[:max(budget, 1)]
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    keep = np.empty(budget, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(budget - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[stop:edges[i + 2]].mean()
+            next_y = y[stop:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Twice the area of each triangle; only which one is largest matters.
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax_indices(x, y, budget):
+    """
+    Purpose: Picks the points of a curve to keep with min/max decimation. The curve is split into budget // 2 buckets
+    of neighbouring points, and the lowest and highest point of each bucket are kept.
+    Parameters:
+        x(numpy array): the x values of the curve, in order. Only their number is used.
+        y(numpy array): the y values of the curve.
+        budget(int): the most points to keep.
+    Returns:
+        (numpy array): the positions of the points kept, in order.
+    """
+    n = len(x)
+    if budget >= n:
+        return np.arange(n)
+    buckets = max(budget // 2, 1)
+    ids = np.arange(n) * buckets // n
+    # Sorting by bucket, then by value within each bucket, puts each bucket's lowest point first and highest last.
+    order = np.lexsort((y, ids))
+    starts = np.searchsorted(ids, np.arange(buckets))
+    ends = np.append(starts[1:], n)
+    return np.unique(np.concatenate((order[starts], order[ends - 1])))
+
+
+METHODS = {'lttb': lttb_indices, 'minmax': minmax_indices}
+
+
+def _spread(count, limit):
+    # Evenly spaced positions of at most limit of count items, always including the first and last.
+    if count <= limit:
+        return np.arange(count)
+    return np.unique(np.linspace(0, count - 1, max(limit, 1)).round().astype(np.int64))
+
+
+def downsample(x, y, budget=DEFAULT_POINT_BUDGET, method='lttb'):
+    """
+    Purpose: Thins out the points of one curve.
+    Parameters:
+        x(list or numpy array): the x values of the curve, in order.
+        y(list or numpy array): the y values of the curve.
+        budget(optional int): the most points to keep. Default is DEFAULT_POINT_BUDGET.
+        method(optional str): "lttb" or "minmax". Default is "lttb".
+    Returns:
+        x(numpy array), y(numpy array): the points kept.
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of " + ", ".join(METHODS) + ", not " + repr(method) + ".")
+    x = np.asarray(x)
+    y = np.asarray(y)
+    keep = METHODS[method](x, y, budget)
+    return x[keep], y[keep]
+
+
+def downsample_series(xarr, yarr, budget=DEFAULT_POINT_BUDGET, method='lttb', **columns):
+    """
+    ### Description:
+    -----
+        Thins out several curves to share one point budget, and puts them all into one set of columns, ready for a
+        single bokeh ColumnDataSource.
+    ### Args:
+    -----
+        > **xarr** *(type: list of lists)* -- The x values of each curve.
+        > **yarr** *(type: list of lists)* -- The y values of each curve.
+        > **budget** *(type: optional int)* -- Default is DEFAULT_POINT_BUDGET. The most points kept across all the
+            curves. Each curve gets an equal share of at least 2 points, so if there are more than budget / 2 curves,
+            only an evenly spaced selection of budget / 2 of them is kept. None keeps every point of every curve.
+        > **method** *(type: optional str)* -- Default value is "lttb". See downsample.
+        > ****columns** -- One value per curve for each extra column, eg. curve=["Curve0", "Curve1"] or
+            color=["purple", "yellow"], repeated for every point kept from the curve.
+    ### Returns:
+    -----
+        >*(type: dict)*: The columns 'x' and 'y', plus the extra columns, each a numpy array with one value per point.
+    """
+    share = None
+    if budget is not None:
+        keep = _spread(len(xarr), budget // 2)
+        xarr = [xarr[i] for i in keep]
+        yarr = [yarr[i] for i in keep]
+        columns = {name: [values[i] for i in keep] for name, values in columns.items()}
+        share = max(budget // max(len(xarr), 1), 2)
+    xs, ys = [], []
+    for x, y in zip(xarr, yarr):
+        x, y = (np.asarray(x), np.asarray(y)) if share is None else downsample(x, y, share, method)
+        xs.append(x)
+        ys.append(y)
+    counts = [len(x) for x in xs]
+    data = {'x': np.concatenate(xs) if xs else np.array([]), 'y': np.concatenate(ys) if ys else np.array([])}
+    for name, values in columns.items():
+        data[name] = np.repeat(np.asarray(values), counts)
+    return data
+
+
+def downsample_stack(stack, budget=DEFAULT_POINT_BUDGET, method='minmax'):
+    """
+    Purpose: Thins out the energies of a ScanStack for plotting, keeping the same energies for every scan and channel.
+    The energies are picked from the average of all the scans and channels, and there are as many of them as the
+    budget allows for the number of scans and channels, but never fewer than 2. So that the budget holds however many
+    scans there are, only an evenly spaced selection of the scans (and, failing that, of the channels) is kept once
+    there are more than budget / 2 curves.
+    Parameters:
+        stack(ScanStack): the scans to thin out.
+        budget(optional int): the most values kept across all the scans and channels. Default is DEFAULT_POINT_BUDGET.
+        method(optional str): "lttb" or "minmax". Default is "minmax".
+    Returns:
+        (ScanStack): a copy of stack with only the energies kept.
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of " + ", ".join(METHODS) + ", not " + repr(method) + ".")
+    channels = _spread(len(stack.channels), budget // 2)
+    scans = _spread(len(stack), budget // 2 // max(len(channels), 1))
+    if len(scans) < len(stack) or len(channels) < len(stack.channels):
+        stack = ScanStack(stack.data[scans][:, :, channels], stack.energy, [stack.channels[i] for i in channels],
+                          stack.sample, [stack.scan_indices[i] for i in scans])
+    share = max(budget // max(len(stack) * len(stack.channels), 1), 2)
+    average = np.nanmean(stack.data, axis=(0, 2)) if len(stack) and stack.channels else stack.energy
+    keep = METHODS[method](stack.energy, average, share)
+    return ScanStack(stack.data[:, keep], stack.energy[keep], stack.channels, stack.sample, stack.scan_indices)
@@ -0,0 +1,142 @@
+"""
+### Overview: Optional timing and memory measurements for each stage of a prediction. A StageRecorder is passed into
+predict_num_scans (and the functions it calls), and each stage (validating, loading, interpolating, extracting the sdd
+values, finding the cut-off, forecasting) is recorded with its wall time, CPU time, memory use and whatever sizes and
+iteration counts the stage adds. The records are plain dicts, so they can be written out as JSON lines and gathered up
+across batch runs. When no recorder is given, NULL_RECORDER is used, which records nothing and costs next to
+nothing.###
+"""
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def _max_rss():
+    # The resource module only exists on Unix, so elsewhere the peak memory isn't recorded.
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class StageRecorder:
+    """
+    ### Description:
+    -----
+        Records how long each stage of a prediction takes and how much memory it uses.
+    ### Args:
+    -----
+        > **trace_memory** *(type: optional boolean)* -- Default value is False. If set to True, Python's memory
+            allocations are traced with tracemalloc, and each record gets the peak memory allocated during the stage.
+            Tracing slows allocation-heavy code down noticeably, so it's off unless asked for. If the recorder starts
+            the tracing, it's stopped again when the recorder is closed, or at the end of a with block using it.
+        > ****context** -- Added to every record, eg. sample="Imidazol - C", so records can be told apart once
+            they've been gathered up.
+    """
+
+    def __init__(self, trace_memory=False, **context):
+        self.trace_memory = trace_memory
+        self.context = context
+        self.records = []
+        self._stack = []
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """Stops tracing memory allocations, if this recorder was the one that started it. The records are kept."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.trace_memory = False
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Purpose: Records a stage of the prediction, as a with block.
+        Parameters:
+            name(str): the name of the stage. Stages inside other stages are named "outer/inner".
+            **info: added to the stage's record.
+        Yields:
+            record(dict): the stage's record. Sizes and counts worked out during the stage can be added to it.
+        """
+        path = '/'.join([frame['name'] for frame in self._stack] + [name])
+        record = dict(self.context, stage=path, **info)
+        frame = {'name': name, 'child_peak': 0, 'start_traced': 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # The peak is about to be reset, so the enclosing stage keeps the peak it's reached so far.
+                self._stack[-1]['child_peak'] = max(self._stack[-1]['child_peak'], peak)
+            frame['start_traced'] = current
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        start_rss = _max_rss()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['wall_time'] = time.perf_counter() - start_wall
+            record['cpu_time'] = time.process_time() - start_cpu
+            record['max_rss'] = _max_rss()
+            record['max_rss_increase'] = None if start_rss is None else record['max_rss'] - start_rss
+            self._stack.pop()
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+                record['traced_peak'] = peak - frame['start_traced']
+                if self._stack:
+                    self._stack[-1]['child_peak'] = max(self._stack[-1]['child_peak'], peak)
+            self.records.append(record)
+
+    def write_json_lines(self, f):
+        """Writes each record as a line of JSON, to an open file or to the file with the name given."""
+        if isinstance(f, str):
+            with open(f, 'a') as out:
+                return self.write_json_lines(out)
+        for record in self.records:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullRecorder:
+    """A recorder that records nothing, used when no StageRecorder is given."""
+    __slots__ = ()
+    records = ()
+    _stage = _NullStage()
+
+    def __bool__(self):
+        return False
+
+    def stage(self, name, **info):
+        return self._stage
+
+
+NULL_RECORDER = _NullRecorder()
@@ -0,0 +1,51 @@
+"""
+### Overview: Tries out live_predict without a beamline. Synthetic scans are written into a temporary directory one at
+a time, as the beamline would write them, while live_predict.watch follows the directory and prints its estimate of
+how many more scans are needed after each one.
+
+Usage:
+    python live_demo.py --scans 40 --interval 0.5###
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+from live_predict import watch
+from synthetic_scans import write_scan_file
+
+
+async def write_scans(directory, num_scans, interval):
+    for i in range(1, num_scans + 1):
+        filename = os.path.join(directory, 'scan_{:03d}.hdf5'.format(i))
+        # Writing to a temporary name first, so the watcher never sees a half written file.
+        await asyncio.to_thread(write_scan_file, filename + '.part', 1, seed=i)
+        os.replace(filename + '.part', filename)
+        await asyncio.sleep(interval)
+
+
+async def run(num_scans, interval, percent_of_log):
+    with tempfile.TemporaryDirectory() as directory:
+        writer = asyncio.create_task(write_scans(directory, num_scans, interval))
+        async for estimate in watch(directory, percent_of_log, poll_interval=interval / 2):
+            if estimate['additional_scans'] is None:
+                print("Scan {scans}: waiting for the initial scans.".format(**estimate), flush=True)
+            else:
+                print("Scan {scans}: {additional_scans} additional scans needed (cut-off {cut_off}).".format(**estimate),
+                      flush=True)
+            if estimate['scans'] >= num_scans:
+                break
+        writer.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch synthetic scans being written and predict as they land.")
+    parser.add_argument('--scans', type=int, default=40, help="number of synthetic scans to write")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between scans")
+    parser.add_argument('--percent-of-log', type=float, default=0.4)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.scans, args.interval, args.percent_of_log))
+
+
+if __name__ == '__main__':
+    main()
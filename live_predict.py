@@ -0,0 +1,220 @@
+"""
+### Overview: Predicts the number of additional scans needed while a sample is still being scanned. A beamline output
+directory (or a single hdf5 file that scans are being added to) is watched, and each new scan is added to the running
+mean as soon as it's written. Only the new scan is processed each time: the running mean, the differences between
+scans and the cut-off carry over from the scans before it. After every scan, the current estimate of how many more
+scans are needed is published, so acquisition can stop as soon as the cut-off is met.
+
+Usage:
+    python live_predict.py /data/beamline/current/ --percent-of-log 0.4###
+"""
+import argparse
+import asyncio
+import os
+
+from batch_predict import HDF5_EXTENSIONS
+from native_interpolate import interpolate_scans
+from predict_num_scans import RESOLUTION, additional_scans, find_cut_off, predict_cut_off
+from scan_metadata import read_file_metadata
+from scan_stats import RollingVariance, ScanAccumulator
+
+# The number of recent differences averaged when looking for the cut-off. See find_cut_off.
+WINDOW = 10
+
+
+def load_sdd(filename, entry, grid=None):
+    """
+    Purpose: Interpolates one scan of a file and returns its sdd values. Only the scan asked for is read, so a file
+    that scans keep being added to costs the same to follow no matter how many scans it already holds.
+    Parameters:
+        filename(str): the hdf5 file the scan is in.
+        entry(str): the scan's entry within the file.
+        grid(optional numpy array): the energy grid to interpolate onto, so the scan lines up with the scans before
+        it. Default is a grid covering the scan's own energies.
+    Returns:
+        (ScanStack): the scan's interpolated sdd values.
+    """
+    for scan in read_file_metadata(filename):
+        if scan['entry'] == entry:
+            sdd = [name for name in scan['signals'] if 'sdd' in name]
+            return interpolate_scans([scan], sdd, RESOLUTION, grid=grid).sdd()
+    raise KeyError("No scan entry " + repr(entry) + " in " + repr(filename) + ".")
+
+
+class LivePrediction:
+    """
+    ### Description:
+    -----
+        The state of a prediction that's updated one scan at a time.
+    ### Args:
+    -----
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **num_scans** *(type: optional int)* -- Default value is 10. The number of scans the cut-off is worked out
+            from. No estimate is made until this many scans have been added.
+    """
+
+    def __init__(self, percent_of_log=0.4, num_scans=10):
+        self.percent_of_log = percent_of_log
+        self.num_scans = num_scans
+        self.sample = None
+        self.scans = 0
+        self.cut_off = None
+        self.accumulator = ScanAccumulator()
+        # The most recent measured differences, and the scan at which their average first fell to the cut-off.
+        self.recent = None
+        self.measured_cut_off_scan = None
+        self._window_end = 0
+
+    def add_scan(self, sdd, sample=None):
+        """
+        Purpose: Adds a scan to the running mean and updates the estimate.
+        Parameters:
+            sdd(numpy array): the scan's interpolated sdd values.
+            sample(optional str): the name of the sample the scan is from. Scans must all be from the same sample.
+        Returns:
+            estimate(dict): with the keys 'sample', 'scans' (the number of scans added so far), 'accepted' (whether the
+            scan was kept in the running mean), 'cut_off', 'cut_off_scan' and 'additional_scans'. The last three are
+            None until num_scans scans have been added, and 'error' is set if the forecast couldn't be made.
+        """
+        if self.sample is None:
+            self.sample = sample
+        elif sample is not None and sample != self.sample:
+            raise ValueError("In order to predict, the scans must all be from the same sample. Scan from sample "
+                             + str(sample) + " found while watching sample " + str(self.sample) + ".")
+        accepted = self.accumulator.push(sdd)
+        self.scans += 1
+        estimate = {'sample': self.sample, 'scans': self.scans, 'accepted': accepted, 'cut_off': None,
+                    'cut_off_scan': None, 'additional_scans': None}
+        diff_list, indices = self.accumulator.result()
+        if len(diff_list) < self.num_scans - 1:
+            return estimate
+        if self.cut_off is None:
+            # The cut-off only depends on the initial batch of scans, so it's worked out once.
+            self.cut_off = predict_cut_off([item for item in diff_list[: self.num_scans - 1]], self.percent_of_log)[2]
+        estimate['cut_off'] = self.cut_off
+        self._slide_window(diff_list)
+        if self.measured_cut_off_scan is not None:
+            # The measured differences have reached the cut-off by themselves, so there's nothing left to forecast.
+            cut_off_scan = self.measured_cut_off_scan
+        else:
+            try:
+                cut_off_scan = find_cut_off(diff_list, self.cut_off, indices, WINDOW)[0]
+            except RuntimeError as e:
+                estimate['error'] = str(e)
+                return estimate
+        estimate['cut_off_scan'] = cut_off_scan
+        estimate['additional_scans'] = int(additional_scans(cut_off_scan, self.scans))
+        return estimate
+
+    def _slide_window(self, diff_list):
+        # Moves the window of recent measured differences along the ones added since the last scan, one push each,
+        # checking every window it passes for the cut-off the same way find_cut_off does.
+        if self.recent is None:
+            if len(diff_list) < WINDOW:
+                return
+            self.recent = RollingVariance(diff_list[:WINDOW])
+            self._check_window(WINDOW)
+        for position in range(self._window_end, len(diff_list)):
+            self.recent.push(diff_list[position])
+            self._check_window(position + 1)
+
+    def _check_window(self, end):
+        # end is the number of differences up to the end of the window. The difference at position end - 1 is between
+        # scans end and end + 1, counting from 1, so the cut-off is reached at scan end + 1.
+        self._window_end = end
+        if self.measured_cut_off_scan is None and self.recent.mean <= self.cut_off:
+            self.measured_cut_off_scan = end + 1
+
+
+def _scan_files(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(HDF5_EXTENSIONS))
+
+
+def _new_scans(path, seen, known):
+    # known holds the scans of each file read so far, with the (modification time, size) the file had when it was
+    # read, so a file is only opened again once it's changed.
+    scans = []
+    for filename in _scan_files(path):
+        try:
+            stat = os.stat(filename)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if filename not in known or known[filename][0] != stamp:
+                known[filename] = (stamp, read_file_metadata(filename))
+        except (OSError, ValueError):
+            # The file is still being written, so it's tried again on the next poll.
+            continue
+        for scan in known[filename][1]:
+            if (filename, scan['entry']) not in seen and any('sdd' in name for name in scan['signals']):
+                scans.append(scan)
+    return scans
+
+
+async def watch(path, percent_of_log=0.4, num_scans=10, poll_interval=1.0, load_scan=load_sdd, stop_when_met=True):
+    """
+    ### Description:
+    -----
+        Watches a directory or a single hdf5 file for new scans, and yields an updated estimate after each one.
+    ### Args:
+    -----
+        > **path** *(type: str)* -- The directory or hdf5 file to watch.
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **num_scans** *(type: optional int)* -- Default value is 10. See LivePrediction.
+        > **poll_interval** *(type: optional float)* -- Default value is 1. How often to look for new scans, in seconds.
+        > **load_scan** *(type: optional function)* -- Default value is load_sdd. Called with the file and entry of each
+            new scan and the energy grid of the first scan (None for the first scan itself), and returns a ScanStack
+            of the scan's interpolated sdd values on that grid. It's run in a worker thread. If it raises an OSError,
+            ValueError or KeyError for a scan, the scans after it wait, and it's tried again on the next poll.
+        > **stop_when_met** *(type: optional boolean)* -- Default value is True. If True, watching stops once the
+            cut-off has been met.
+    ### Yields:
+    -----
+        >*(type: dict)*: The estimate after each new scan, as returned by LivePrediction.add_scan, with the scan's
+            'file' and 'entry' added.
+    """
+    loop = asyncio.get_running_loop()
+    prediction = LivePrediction(percent_of_log, num_scans)
+    seen = set()
+    known = {}
+    grid = None
+    while True:
+        scans = await loop.run_in_executor(None, _new_scans, path, seen, known)
+        for scan in scans:
+            try:
+                stack = await loop.run_in_executor(None, load_scan, scan['file'], scan['entry'], grid)
+            except (OSError, ValueError, KeyError):
+                # The scan is still being written, so it's tried again on the next poll. The scans after it wait for
+                # it, so the scans are still added in the order they were taken.
+                break
+            seen.add((scan['file'], scan['entry']))
+            if grid is None:
+                grid = stack.energy
+            estimate = prediction.add_scan(stack.data[0], scan['sample'])
+            estimate.update({'file': scan['file'], 'entry': scan['entry']})
+            yield estimate
+            if stop_when_met and estimate['additional_scans'] == 0:
+                return
+        await asyncio.sleep(poll_interval)
+
+
+async def _print_estimates(args):
+    async for estimate in watch(args.path, args.percent_of_log, args.num_scans, args.poll_interval):
+        if estimate['additional_scans'] is None:
+            print("Scan {scans} ({file} {entry}): waiting for the initial scans.".format(**estimate), flush=True)
+        else:
+            print("Scan {scans} ({file} {entry}): {additional_scans} additional scans needed.".format(**estimate),
+                  flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict the number of additional scans needed as scans are taken.")
+    parser.add_argument('path', help="directory or hdf5 file to watch")
+    parser.add_argument('--percent-of-log', type=float, default=0.4)
+    parser.add_argument('--num-scans', type=int, default=10)
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between looks for new scans")
+    asyncio.run(_print_estimates(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+### Overview: Interpolates scans onto a regular energy grid straight from the hdf5 files, as an alternative to
+SGMData.interpolate. Each scan's energy axis and sdd signals are read with h5py, every point is put in the grid bin
+nearest its energy, and the points in each bin are averaged with NumPy. Bins no point landed in are filled in linearly
+from the bins either side. All of a sample's scans end up in one contiguous (scans x energies x channels) array, with
+no pandas dataframes made along the way.###
+"""
+import h5py
+import numpy as np
+
+from scan_stack import ScanStack
+
+# The name of the signal holding each scan's energy axis.
+ENERGY_SIGNAL = 'en'
+
+
+def energy_grid(energies, resolution=0.1):
+    """
+    Purpose: Makes a regular energy grid covering every one of a set of energy axes.
+    Parameters:
+        energies(list of numpy arrays): the energy axes of the scans.
+        resolution(optional float): the spacing of the grid. Default value is 0.1.
+    Returns:
+        (numpy array): the energies at the centres of the grid's bins.
+    """
+    start = np.floor(min(np.min(en) for en in energies) / resolution) * resolution
+    stop = np.ceil(max(np.max(en) for en in energies) / resolution) * resolution
+    return start + resolution * np.arange(int(round((stop - start) / resolution)) + 1)
+
+
+def bin_scan(energy, values, grid, out=None):
+    """
+    Purpose: Averages a scan's values into the bins of an energy grid, and fills in the bins no values landed in. Points
+    whose energy is outside the grid are left out, rather than added to the bins at its ends.
+    Parameters:
+        energy(numpy array): the energy of each of the scan's points.
+        values(numpy array): the scan's values, one row per point and one column per channel.
+        grid(numpy array): the regularly spaced energies at the centres of the bins, as returned by energy_grid.
+        out(optional numpy array): where to put the result. Must have one row per bin and one column per channel.
+    Returns:
+        out(numpy array): the average value of each channel in each bin, or NaN everywhere if none of the scan's points
+        are inside the grid.
+    """
+    resolution = grid[1] - grid[0] if len(grid) > 1 else 1.0
+    if out is None:
+        out = np.empty((len(grid), values.shape[1]))
+    idx = np.rint((energy - grid[0]) / resolution)
+    inside = (idx >= 0) & (idx <= len(grid) - 1)
+    if not inside.all():
+        idx, values = idx[inside], values[inside]
+    if len(idx) == 0:
+        out[:] = np.nan
+        return out
+    idx = idx.astype(np.intp)
+    order = np.argsort(idx, kind='stable')
+    filled, starts, counts = np.unique(idx[order], return_index=True, return_counts=True)
+    means = np.add.reduceat(values[order], starts, axis=0) / counts[:, None]
+    out[filled] = means
+    # Filling in each empty bin from the filled bins on either side of it, or the nearest filled bin at the edges.
+    empty = np.setdiff1d(np.arange(len(grid)), filled, assume_unique=True)
+    if len(empty):
+        if len(filled) > 1:
+            right = np.clip(np.searchsorted(filled, empty), 1, len(filled) - 1)
+        else:
+            right = np.zeros_like(empty)
+        left = np.maximum(right - 1, 0)
+        span = (filled[right] - filled[left]).astype(np.float64)
+        weight = np.divide(empty - filled[left], span, out=np.zeros(len(empty)), where=span > 0)
+        weight = np.clip(weight, 0, 1)[:, None]
+        out[empty] = means[left] * (1 - weight) + means[right] * weight
+    return out
+
+
+def channel_names(signals, sdd):
+    """
+    Purpose: Names the columns the sdd signals of a scan are flattened into, in the way SGMData.interpolate does.
+    Parameters:
+        signals(dict): the scan's signals, as in the report from read_scan_metadata.
+        sdd(list of str): the names of the sdd signals.
+    Returns:
+        (list of str): "sdd1-0", "sdd1-1", etc. for signals with more than one bin, or just the signal's name.
+    """
+    names = []
+    for name in sdd:
+        shape = signals[name]['shape']
+        if len(shape) > 1:
+            names.extend('{}-{}'.format(name, i) for i in range(shape[1]))
+        else:
+            names.append(name)
+    return names
+
+
+def _read_scan(h5, scan, sdd):
+    signals = scan['signals']
+    energy = h5[signals[ENERGY_SIGNAL]['path']][()]
+    values = np.concatenate([h5[signals[name]['path']][()].reshape(len(energy), -1) for name in sdd], axis=1)
+    return energy, values
+
+
+def interpolate_scans(scans, sdd, resolution=0.1, dtype=np.float64, filename=None, handles=None, grid=None):
+    """
+    ### Description:
+    -----
+        Interpolates scans onto a shared energy grid, reading only their energy axes and sdd signals from the hdf5
+        files.
+    ### Args:
+    -----
+        > **scans** *(type: list of dicts)* -- The scans to interpolate, as in the 'scans' of the report from
+            read_scan_metadata.
+        > **sdd** *(type: list of str)* -- The names of the sdd signals to interpolate.
+        > **resolution** *(type: optional float)* -- Default value is 0.1. The spacing of the energy grid.
+        > **dtype** *(type: optional numpy dtype)* -- Default value is float64. Use float32 to halve the memory used by
+            the result.
+        > **filename** *(type: optional str)* -- If given, the result is kept in a memory-mapped .npy file of this
+            name instead of in memory.
+        > **handles** *(type: optional dict)* -- Open h5py files to read from, keyed by file name. They're left open
+            afterwards, so a caller can keep them between calls. Files not in it are opened here and closed again.
+        > **grid** *(type: optional numpy array)* -- The energy grid to interpolate onto, eg. the energy of an earlier
+            ScanStack so new scans line up with it. Points outside it are left out. Default is a grid covering every
+            one of the scans, at resolution.
+    ### Returns:
+    -----
+        >*(type: ScanStack)*: The interpolated sdd values of the scans.
+    """
+    handles = handles or {}
+    files = {}
+    opened = []
+    try:
+        for scan in scans:
+            if scan['file'] not in files:
+                files[scan['file']] = handles.get(scan['file'])
+                if files[scan['file']] is None:
+                    files[scan['file']] = h5py.File(scan['file'], 'r')
+                    opened.append(files[scan['file']])
+        # The energy axes are small, so they're all read first to find the grid the scans share.
+        if grid is None:
+            energies = [files[scan['file']][scan['signals'][ENERGY_SIGNAL]['path']][()] for scan in scans]
+            grid = energy_grid(energies, resolution)
+        stack = ScanStack.allocate(len(scans), grid, channel_names(scans[0]['signals'], sdd), scans[0]['sample'],
+                                   dtype, filename)
+        # The sdd signals are read one scan at a time, straight into their place in the stack.
+        for i, scan in enumerate(scans):
+            energy, values = _read_scan(files[scan['file']], scan, sdd)
+            bin_scan(energy, values, grid, out=stack[i])
+    finally:
+        for h5 in opened:
+            h5.close()
+    return stack
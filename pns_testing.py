@@ -1,75 +1,63 @@
 # General imports
 import glob
-from IPython.testing.globalipapp import get_ipython
-import asyncio
-import h5py
-import pandas
-from dask.distributed import Client
-from distributed import Client
 import numpy as np
 import os
 import sys
 import inspect
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))))
-import sgmdata
-from lmfit import Model
-from sgmdata.load import SGMData
-import sgmdata.report
-from collections import OrderedDict
-# Plotting function imports
-from bokeh.plotting import figure, ColumnDataSource
-from bokeh.models import HoverTool, CustomJS, BooleanFilter, LinearColorMapper, LogColorMapper, ColorBar
-from bokeh.io import show
+from downsample import DEFAULT_POINT_BUDGET, downsample_series
+from scan_stack import ScanStack
+from scan_stats import ScanAccumulator, rolling_variance
 
-ip = get_ipython()
 
+# Only prompting for files when run as a script, so the functions below can be imported (eg. by the benchmarks).
+if __name__ == "__main__":
+    # These are only needed for loading the files asked for here.
+    import h5py
+    from scan_index import default_index
 
-# GETTING DATA FILES FROM DISK * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+    # GETTING DATA FILES FROM DISK * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 
-l = []
+    l = []
 
-desired_file = input("Please input the absolute path to your hdf5 file: ")
-for filename in glob.iglob(desired_file, recursive=True):
-    l.append(filename)
-if l.isempty():
-    print("There were no files matching your description found in the specified directory.\n")
-else:
-    print("The following files match your input: " + str(l))
+    desired_file = input("Please input the absolute path to your hdf5 file: ")
+    for filename in glob.iglob(desired_file, recursive=True):
+        l.append(filename)
+    if not l:
+        print("There were no files matching your description found in the specified directory.\n")
+    else:
+        print("The following files match your input: " + str(l))
 
 
-# LOADING DATA * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+    # LOADING DATA * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 
-# Creates a new SGMData object
-sgm_data = sgmdata.load.SGMData(l, sample = "Imidazol - C")
-
-table = None
-a_dict = OrderedDict()
-sample_keys = list(sgm_data.scans.keys())
-for sample in sample_keys:
-    for entry in sgm_data.scans[sample].__dict__:
-        # print("Entry: " + str(entry))
-        for section in sgm_data.scans[sample].__dict__[entry]:
-            if len(sgm_data.scans[sample].__dict__[entry]) > 0:
-                if type(sgm_data.scans[sample].__dict__[entry]) is not str:
-                    if type(sgm_data.scans[sample].__dict__[entry][section]) is not int:
-                        # print("\tSection: " + str(section))
-                        for subsect in sgm_data.scans[sample].__dict__[entry][section]:
-                            if "sdd" in subsect:
-                                if type(sgm_data.scans[sample].__dict__[entry][section]) is dict:
-                                    # print("\t\tSubsect: " + str(subsect))
-                                    table = (sgm_data.scans[sample].__dict__[entry][section][subsect].__array__())
+    # Looking the sdd signals up in the scan index, rather than loading the files into an SGMData object and walking
+    # through every section of every entry. The table is the last sdd signal of the last scan, read straight from its
+    # hdf5 file.
+    table = None
+    sdd_signals = default_index().find_signals(l, 'sdd')
+    if sdd_signals:
+        with h5py.File(sdd_signals[-1]['file'], 'r') as h5:
+            table = h5[sdd_signals[-1]['path']][()]
 
 
 # FUNCTIONS * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 
-def plot1d(xarr, yarr):
+def plot1d(xarr, yarr, budget=DEFAULT_POINT_BUDGET, method='lttb'):
     """
     Sets the specifications for a graph, then shows graph. Graph represents the data samples, and the predicted data
     samples.
     Variables:
         xarr: a list of two lists containing the x values for the points we will be plotting.
         yarr: a list of two lists containing the y values for the points we will be plotting.
+        budget: the most points plotted, shared between the curves. Defaults to DEFAULT_POINT_BUDGET; None plots every
+        point.
+        method: how each curve is thinned out to its share of the budget, "lttb" or "minmax". Defaults to "lttb".
     """
+    # Plotting function imports, only made when a plot is actually asked for.
+    from bokeh.plotting import figure, ColumnDataSource
+    from bokeh.models import CDSView, GroupFilter
+    from bokeh.io import show
     # A string listing the tools we will have available for our graph.
     TOOLS = 'pan, hover, box_zoom, box_select, crosshair, reset, save'
     # Specifying the appearance of our graph.
@@ -86,15 +74,18 @@ def plot1d(xarr, yarr):
     # 'red', 'orange' " to the 'colors' list.
     for i in range(np.floor(len(yarr) / 6).astype(int) + 1):
         colors += ['purple', 'yellow', 'black', 'firebrick', 'red', 'orange']
-    # Making colors variable into an iterator that can iterate through the previous version of colors.
-    colors = iter(colors)
     if not isinstance(xarr, list):
         xarr = [xarr]
     if not len(xarr) == len(yarr):
         yarr = [yarr]
-    # For the number of items in xarr, plot a new point on our graph.
-    for i, x in enumerate(xarr):
-        fig.circle(x=x, y=yarr[i], color=next(colors), legend_label="Curve" + str(i))
+    # Thinning every curve out to its share of the point budget, and putting them all into one ColumnDataSource, so the
+    # points are only sent to the browser once however many curves there are. Each curve still gets its own glyph,
+    # drawing only its own points through a filter on the curve column, so it can be hidden from the legend.
+    curves = ["Curve" + str(i) for i in range(len(xarr))]
+    source = ColumnDataSource(downsample_series(xarr, yarr, budget, method, curve=curves))
+    for curve, color in zip(curves, colors):
+        view = CDSView(filter=GroupFilter(column_name='curve', group=curve))
+        fig.scatter(x='x', y='y', color=color, legend_label=curve, source=source, view=view)
     fig.legend.location = "top_left"
     fig.legend.click_policy = "hide"
     show(fig)
@@ -108,75 +99,31 @@ def lowest_variance(d_list):
         d_list: the list of variances between each consecutive spot on a graph.
     """
     print("\nd_list: \n" + str(d_list))
-    pos = 0
-    recent_differences = []
-    differences = []
-    recent_vars = []
-    for diff in d_list:
-        if len(recent_vars) < 4:
-            recent_vars.append(diff)
-        elif len(recent_vars) == 4:
-            recent_differences.clear()
-            pos = 4
-            recent_vars.append(diff)
-            for var in recent_vars:
-                recent_differences.append(((var - np.mean(recent_vars)) ** 2))
-            differences.append(np.sum(recent_differences) / len(recent_differences))
-        else:
-            recent_differences.clear()
-            pos = pos + 1
-            recent_vars.pop(0)
-            recent_vars.append(diff)
-            for var in recent_vars:
-                recent_differences.append(((var - np.mean(recent_vars)) ** 2))
-            differences.append(np.sum(recent_differences) / len(recent_differences))
-    # print("difference: \n" + str(differences))
+    # The variance of every 5 consecutive values, calculated in one pass.
+    differences = rolling_variance(d_list, 5)
     i = 0
     for boop in differences:
         print(str(i) + "-" + str(i + 4) + " difference is: " + str(boop))
         i += 1
+    pos = int(np.argmin(differences)) + 4
     return "The lowest average variance (of the variance between 2 consecutive variances) between 5 consecutive " \
-           "variances is " + str(min(differences)) + ".\nIt is reached with the variances between the " \
+           "variances is " + str(differences[pos - 4]) + ".\nIt is reached with the variances between the " \
             "values within the range: " + str(pos - 4) + " through to position: " + str(pos) + ".\n"
 
 
 # INTERPOLATING DATA * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 def interpolating_data(interp_list_param):
-    """Takes the data returned from interpolate and collects the sdd values. Sorts through these sdd values and removes
-     unfit values. Keeps a separate list of the indices of the fit values. Deals with nan and infinity values in the
-     list of sdd values and returns it to caller as a numpy array."""
-    sdd_list = []
-    # Checking for items in interp_list containing the characters 'sdd.' those items are appended to sdd_list.
-    for df in interp_list_param:
-        sdd_list.append(df.filter(regex=("sdd.*"), axis=1).to_numpy())
-
-    prev_mean = sdd_list[0]
-    avg_list = [sdd_list[0]]
-    diff_list = []
-    indices = []
-    for i, arr in enumerate(sdd_list[1:]):
-        # *Note that arr is the array of arrays representing the each scan's sdd values and i is the count of the number of
-        # times the loop has been cycled through, starting at 0.
-        avg_list.append(arr)
-        cur_mean = np.mean(avg_list, axis=0)
-        # * Cur_mean is an array with the mean of all values in the same positions in the in arrays within avg_list. Eg, the
-        # average of the item [0] of each of the lists, then the average of the item[1] of each of the lists, etc.
-        # Finding the variance between the last scan and the current scan.
-        diff_list.append(np.var(np.subtract(cur_mean, prev_mean)))
-        if len(diff_list) > 2:
-            if diff_list[-2] - diff_list[-1] < -50:
-                avg_list = avg_list[:-1]
-                diff_list = diff_list[:-1]
-                # If the variance between the difference between our current scan's mean and the mean of the scan before it
-                # is 51 or more than the variance of the difference between the previous scan's mean and the mean of the
-                # scan before it, then don't include the variance of the difference between the current scan's mean and the
-                # previous scan's mean in diff list, or the average of this scan in avg_list.
-            else:
-                indices.append(i)
-                prev_mean = cur_mean
-        else:
-            indices.append(i)
-            prev_mean = cur_mean
-    # Turns diff_list into and array, then converts NaN values to 0s and deals with infinity values.
-    diff_list = np.nan_to_num(np.array(diff_list))
-    return diff_list, indices
+    """Takes the data returned from check_sample_fitness (a ScanStack, or a list of dataframes from interpolate) and
+     collects the sdd values. Sorts through these sdd values and removes unfit values. Keeps a separate list of the
+     indices of the fit values. Deals with nan and infinity values in the list of sdd values and returns it to caller as
+     a numpy array."""
+    if not isinstance(interp_list_param, ScanStack):
+        interp_list_param = ScanStack.from_frames(interp_list_param)
+    accumulator = ScanAccumulator()
+    # Adding the sdd values of each scan to the running mean one scan at a time. Each scan is a view of the stack, so
+    # nothing is copied. Scans whose variance jumps by more than 50 over the previous scan are left out of the mean by
+    # the accumulator, and only the indices of the scans that were kept are recorded.
+    for arr in interp_list_param.sdd():
+        accumulator.push(arr)
+    # diff_list comes back as an array, with NaN values converted to 0s and infinity values dealt with.
+    return accumulator.result()
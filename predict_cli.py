@@ -0,0 +1,137 @@
+"""
+### Overview: The command line for predicting how many additional scans a sample needs, for use from beamline automation
+scripts. The sample's files, the thresholds and the output format are all given as arguments, so nothing is prompted
+for, and the result is written as JSON (or as plain text with --format text). Only the standard library and the
+defaults in prediction_defaults are imported up front: numpy, h5py, lmfit and sgmdata are imported once the arguments
+have been read, and bokeh only when --plot is given, so --help and mistyped arguments come back straight away.
+
+Usage:
+    python predict_cli.py /data/sample/ --num-scans 10 --percent-of-log 0.4
+    python predict_cli.py "/data/sample/*.hdf5" --engine native --uncertainty 10000 --output result.json###
+"""
+import argparse
+import json
+import sys
+
+from prediction_defaults import DEFAULT_DESIRED_DIFFERENCE
+
+# The fields of the result, in the order they're written.
+RESULT_FIELDS = ('sample', 'files', 'num_scans', 'additional_scans', 'cut_off', 'cut_off_scan', 'average',
+                 'log_average', 'predicted', 'uncertainty', 'error')
+
+
+def build_parser():
+    """Returns the command line's argument parser."""
+    parser = argparse.ArgumentParser(description="Predict the number of additional scans needed for a sample.")
+    parser.add_argument('paths', nargs='+', help="the sample's hdf5 files, directories or glob patterns")
+    parser.add_argument('--percent-of-log', type=float, default=0.4,
+                        help="fraction of the log of the initial noise level to stop at (default: 0.4)")
+    parser.add_argument('--num-scans', type=int, default=10,
+                        help="number of initial scans to predict from (default: 10)")
+    parser.add_argument('--engine', choices=('sgmdata', 'native'), default='sgmdata',
+                        help="how scans are interpolated (default: sgmdata)")
+    parser.add_argument('--no-cache', action='store_true', help="don't read or store interpolated scans in the cache")
+    parser.add_argument('--uncertainty', type=int, metavar='REPLICATES',
+                        help="add a Monte Carlo confidence interval for the additional scans, from this many replicates")
+    parser.add_argument('--desired-difference', type=float, nargs='?', const=DEFAULT_DESIRED_DIFFERENCE,
+                        help="make --uncertainty's interval for determine_num_scans' variance rule, aiming for this "
+                             "variance (without a value: %(const)s), instead of for the additional scans reported")
+    parser.add_argument('--seed', type=int, help="seed for --uncertainty, so its result can be made again")
+    parser.add_argument('--format', choices=('json', 'text'), default='json', help="output format (default: json)")
+    parser.add_argument('-o', '--output', default='-', help="file to write the result to (default: stdout)")
+    parser.add_argument('--plot', action='store_true', help="plot the scans and the predicted noise levels with bokeh")
+    parser.add_argument('--timings', help="file to append the time and memory taken by each stage to, as JSON lines")
+    return parser
+
+
+def summarise(details):
+    """
+    Purpose: Picks the parts of a prediction that make up the result, as plain numbers that can be written as JSON.
+    Parameters:
+        details(dict): the details of the prediction, as returned by prediction_details.
+    Returns:
+        (dict): the 'sample', 'num_scans', 'additional_scans', 'cut_off', 'cut_off_scan', 'average', 'log_average' and
+        'predicted' noise levels.
+    """
+    return {
+        'sample': details['sample'],
+        'num_scans': details['num_scans'],
+        'additional_scans': int(details['additional_scans']),
+        'cut_off': float(details['cut_off']),
+        'cut_off_scan': int(details['cut_off_scan']),
+        'average': float(details['average']),
+        'log_average': float(details['log_average']),
+        'predicted': [float(level) for level in details['predicted']],
+    }
+
+
+def run(args):
+    """
+    Purpose: Predicts the number of additional scans for the sample given on the command line.
+    Parameters:
+        args(argparse Namespace): the parsed command line arguments.
+    Returns:
+        result(dict): the keys in RESULT_FIELDS that apply. 'error' is only present if the prediction failed.
+    """
+    from batch_predict import find_scan_files
+    from instrumentation import StageRecorder
+    from predict_num_scans import plot_prediction, prediction_details
+
+    files = find_scan_files(args.paths)
+    result = {'sample': None, 'files': len(files)}
+    recorder = StageRecorder() if args.timings else None
+    try:
+        if not files:
+            raise ValueError("No hdf5 files were found at " + ", ".join(args.paths) + ".")
+        details = prediction_details(files, percent_of_log=args.percent_of_log, num_scans=args.num_scans,
+                                     cache=not args.no_cache, engine=args.engine, recorder=recorder)
+        result.update(summarise(details))
+        if args.uncertainty:
+            from scan_uncertainty import monte_carlo_num_predictions, monte_carlo_num_scans
+            if args.desired_difference is None:
+                spread = monte_carlo_num_scans(details['diff_list'], details['indices'], args.percent_of_log,
+                                               details['num_scans'], replicates=args.uncertainty, seed=args.seed)
+                del spread['additional_scans']
+            else:
+                spread = monte_carlo_num_predictions(details['diff_list'], details['indices'],
+                                                     args.desired_difference, replicates=args.uncertainty,
+                                                     seed=args.seed)
+                del spread['num_predictions']
+            result['uncertainty'] = spread
+        if args.plot:
+            plot_prediction(details)
+    except Exception as e:
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    if recorder:
+        recorder.write_json_lines(args.timings)
+    return {field: result[field] for field in RESULT_FIELDS if field in result}
+
+
+def write_result(result, output, output_format='json'):
+    """
+    Purpose: Writes the result of run to a file, or to stdout.
+    Parameters:
+        result(dict): the result to write.
+        output(str): the file to write to, or "-" for stdout.
+        output_format(optional str): "json" or "text". Default is "json".
+    """
+    if output_format == 'json':
+        text = json.dumps(result, indent=2) + '\n'
+    else:
+        text = "".join("{}: {}\n".format(field, value) for field, value in result.items() if field != 'predicted')
+    if output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run(args)
+    write_result(result, args.output, args.format)
+    return 1 if 'error' in result else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
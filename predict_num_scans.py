@@ -7,114 +7,371 @@ module (predict_num_scans) determines how much the noise levels vary in the firs
 how much noise future scans will contain. Based on these predictions, the module will tell the user how many more scans are necesary to 
 reach a sufficiently low level of noise, and provide them with a graph indicating the predicted noise levels for this sample.###
 """
+import os
 
+import numpy as np
 
-def check_sample_fitness(list_of_files):
+from downsample import DEFAULT_POINT_BUDGET, downsample_stack
+from instrumentation import NULL_RECORDER
+from native_interpolate import interpolate_scans
+from prediction_defaults import DEFAULT_DESIRED_DIFFERENCE
+from scan_cache import default_cache
+from scan_index import default_index
+from scan_metadata import read_scan_metadata
+from scan_stack import ScanStack
+from scan_stats import accumulate_scans, first_at_or_below, rolling_mean, rolling_variance
+
+# The energy resolution scans are interpolated at.
+RESOLUTION = 0.1
+# The most predictions determine_num_scans will make before giving up.
+MAX_PREDICTIONS = 60
+
+
+def validate_scan_files(list_of_files, read_file=None):
     """
-    Purpose: Create an SGMData object from hdf5 files. Interpolate the data in the SGMData object. Return this
-    interpolated data.
+    Purpose: Checks that hdf5 files are suitable for predicting the number of scans required, reading only the names
+    and attributes in the files, not the scans themselves.
     Parameters:
-        list_of_files(list of str): the names of the hdf5 files to create an SGMData object out of.
+        list_of_files(list of str): the names of the hdf5 files to check.
+        read_file(optional function): lists the scan entries of one file. See read_scan_metadata. Default looks the
+        files up in the default ScanIndex, so each file is only opened again once it has changed.
     Returns:
-        interp_list(list): a list of pandas dataframes. Contains the interpolated version of the data in the files
-        specified in list_of_files.
+        report(dict): the report from read_scan_metadata, with an extra 'sample' key holding the name of the sample the
+        scans are all from.
     """
-    sgm_data = sgmdata.load.SGMData(list_of_files)
+    if read_file is None:
+        report = default_index().read_scan_metadata(list_of_files)
+    else:
+        report = read_scan_metadata(list_of_files, read_file)
 
-    if len(sgm_data.__dict__['scans']) == 0:
+    if len(report['scans']) == 0:
         raise ValueError("hdf5 file must contain scans to be able to predict the number of scans required. The hdf5 "
                          "file you have provided does not contain any scans. PLease try again with an hdf5 file that"
                          " does contain scans.")
-    has_sdd = False
-    file = list(sgm_data.__dict__['scans'].keys())
-    sample_name = list(sgm_data.__dict__['scans'][file[0]].__dict__.keys())
-    signals = list(sgm_data.__dict__['scans'][file[0]].__getitem__(sample_name[0]).__getattr__('signals').keys())
-    i = 0
-    while i < len(signals) and not has_sdd:
-        if "sdd" in signals[i]:
-            has_sdd = True
-        else:
-            i += 1
-    if not has_sdd:
+    if not report['sdd']:
         raise ValueError("Scans must have sdd values to be able to predict the number of scans required. One or "
                          "more of the scans you have provided do not have sdd values. Please try again using "
                          "scans with sdd values. ")
-    sample_type = sgm_data.__dict__['scans'][file[0]].__getitem__(sample_name[0])['sample']
-    for indiv_file in file:
-        sample_name = list(sgm_data.__dict__['scans'][indiv_file].__dict__.keys())
-        for scan in sample_name:
-            if sgm_data.__dict__['scans'][indiv_file].__getitem__(scan)['sample'] != sample_type:
-                raise ValueError("In order to predict, the scans in the hdf5 file passed in by user must all be from"
-                                 " the same sample. The scans in the hdf5 file passed in by the user are not all from"
-                                 " the same sample. Please "
-                                 "try again with an hdf5 file only containing scans from the"
-                                 " same sample. ")
-    interp_list = sgm_data.interpolate(resolution=0.1)
-    return interp_list
-
-
-def determine_num_scans(d_list, indices, desired_difference=0.17961943):
-    """
-    Purpose: takes a string of variations in noise levels and a desired noise level, and returns the number of additional
-    variations (ie, scans) required to reach the desired noise level.
-    Variables:
-        d_list(list of floats): a list of the differences between our first ten acceptable scans. As our
-        determine_scan_num function continues it will add values to the d_list.
+    if len(report['samples']) > 1:
+        raise ValueError("In order to predict, the scans in the hdf5 file passed in by user must all be from"
+                         " the same sample. The scans in the hdf5 file passed in by the user are not all from"
+                         " the same sample. Please "
+                         "try again with an hdf5 file only containing scans from the"
+                         " same sample. ")
+    report['sample'] = report['samples'][0]
+    return report
+
+
+def check_sample_fitness(list_of_files, num_scans=None, report=None, cache=True, engine='sgmdata', recorder=None,
+                         handles=None):
+    """
+    Purpose: Check that the hdf5 files are suitable, then interpolate the scans in them. Return this interpolated data.
+    Parameters:
+        list_of_files(list of str): the names of the hdf5 files to interpolate the scans of.
+        num_scans(optional int): the number of scans that will be used. If given, only the first num_scans scans are
+        interpolated (with the "sgmdata" engine, only the files holding them are loaded).
+        report(optional dict): the report returned by validate_scan_files for list_of_files, if it's already been made.
+        cache(optional InterpolationCache or bool): the cache to read interpolated scans from and save them to, with the
+        "sgmdata" engine. Default is True, which uses the default cache. If False or None, scans are always
+        interpolated.
+        engine(optional str): "sgmdata" to interpolate with SGMData.interpolate, or "native" to bin the sdd signals
+        straight from the hdf5 files with native_interpolate. Default is "sgmdata".
+        recorder(optional StageRecorder): records the time and memory taken by each stage.
+        handles(optional dict): open h5py files for the "native" engine to read from, keyed by file name. See
+        interpolate_scans.
+    Returns:
+        stack(ScanStack): the interpolated version of the data in the files specified in list_of_files. Scans read
+        from the cache or interpolated by the "native" engine only contain their sdd values.
+    """
+    recorder = recorder or NULL_RECORDER
+    if report is None:
+        with recorder.stage('validate'):
+            report = validate_scan_files(list_of_files)
+    scans = report['scans'][:num_scans]
+    if engine == 'native':
+        with recorder.stage('native_interpolate', scans=len(scans)) as record:
+            stack = interpolate_scans(scans, report['sdd'], resolution=RESOLUTION, handles=handles)
+            record['shape'] = stack.data.shape
+            record['nbytes'] = stack.data.nbytes
+        return stack
+    if engine != 'sgmdata':
+        raise ValueError("engine must be either \"sgmdata\" or \"native\", not " + repr(engine) + ".")
+    if cache is True:
+        cache = default_cache()
+    # If every scan has been interpolated before, there's no need to load or interpolate anything.
+    if cache:
+        with recorder.stage('cache_lookup', scans=len(scans)) as record:
+            keys = [cache.key(scan['file'], scan['entry'], RESOLUTION, report['sdd']) for scan in scans]
+            interp_list = [cache.get(key) for key in keys]
+            record['hits'] = sum(df is not None for df in interp_list)
+        if all(df is not None for df in interp_list):
+            with recorder.stage('stack') as record:
+                stack = ScanStack.from_frames(interp_list, report['sample'])
+                record['nbytes'] = stack.data.nbytes
+            return stack
+    # Only loading the files that hold the scans that will actually be used.
+    files = []
+    for scan in scans:
+        if scan['file'] not in files:
+            files.append(scan['file'])
+    with recorder.stage('load', files=len(files)):
+        # sgmdata (and the dask and pandas it brings with it) is only imported once scans need loading with it, so the
+        # native engine, cached scans and the command line's --help don't pay for it.
+        import sgmdata.load
+        sgm_data = sgmdata.load.SGMData(files)
+    with recorder.stage('interpolate', resolution=RESOLUTION) as record:
+        sgm_data.interpolate(resolution=RESOLUTION)
+        frames = _interpolated_frames(sgm_data)
+        interp_list = []
+        for scan in scans:
+            # SGMData names each file by its name without the directory or extension.
+            name = (os.path.basename(scan['file']).split('.')[0], scan['entry'])
+            if name not in frames:
+                raise RuntimeError("SGMData did not interpolate scan " + scan['entry'] + " of " + scan['file'] + ", so "
+                                   "the prediction can't be made from it. Please check that the file can be loaded "
+                                   "with SGMData and try again.")
+            interp_list.append(frames[name])
+        record['scans'] = len(interp_list)
+    if cache:
+        with recorder.stage('cache_store'):
+            for key, df in zip(keys, interp_list):
+                cache.put(key, df.filter(regex=("sdd.*"), axis=1))
+    with recorder.stage('stack') as record:
+        stack = ScanStack.from_frames(interp_list, report['sample'])
+        record['nbytes'] = stack.data.nbytes
+    return stack
+
+
+def _interpolated_frames(sgm_data):
+    # Each of SGMData's entries keeps the dataframe it was interpolated to under 'binned', so the dataframes can be
+    # matched to the scans by file and entry name, rather than relying on the order SGMData.interpolate returns them in.
+    frames = {}
+    for file_name, sgm_scan in sgm_data.scans.items():
+        entries = sgm_scan.items() if isinstance(sgm_scan, dict) else vars(sgm_scan).items()
+        for entry_name, entry in entries:
+            binned = entry.get('binned') if isinstance(entry, dict) else getattr(entry, 'binned', None)
+            if binned is not None:
+                frames[(file_name, entry_name)] = binned['dataframe']
+    return frames
+
+
+def noise(idx, amp, shift, ofs):
+    """
+    Purpose: The model used for how the noise level of a sample's scans falls off as more scans are taken.
+    Parameters:
+        idx(numpy array of ints): the scan numbers to calculate the noise level for.
+        amp(float): how large the noise level is to begin with.
+        shift(float): how far the scan numbers are shifted before the noise starts falling off.
+        ofs(float): the noise level that is left over however many scans are taken.
+    Returns:
+        (numpy array of floats): the noise level at each of the scan numbers in idx.
+    """
+    return amp * (idx + shift) ** (-3 / 2) + ofs
+
+
+def fit_noise_decay(d_list, indices):
+    """
+    Purpose: Fits the noise model to the differences between a sample's scans.
+    Parameters:
+        d_list(list of floats): the differences between the sample's scans.
+        indices(list of ints): the scan numbers of the scans used to generate d_list.
+    Returns:
+        params(lmfit Parameters): the fitted amp, shift and ofs values of the noise model.
+    """
+    from lmfit import Model
+    d_list = np.asarray(d_list, dtype=np.float64)
+    idx = np.asarray(indices[:len(d_list)], dtype=np.float64)
+    model = Model(noise)
+    params = model.make_params(amp=max(d_list[0], 1e-12) * (idx[0] + 1) ** 1.5, shift=1.0, ofs=0.0)
+    params['amp'].set(min=0)
+    # Keeping idx + shift above 0, so the noise level stays defined for every scan number.
+    params['shift'].set(min=1e-3 - idx.min())
+    params['ofs'].set(min=0)
+    return model.fit(d_list, params, idx=idx).params
+
+
+def forecast_noise(d_list, indices, horizon):
+    """
+    Purpose: Predicts the noise levels of the next horizon scans from a single fit of the noise model. Refitting after
+    every predicted scan, with the prediction added to the differences, gives back the same fit, because the predicted
+    levels sit exactly on the fitted curve and so don't change where the best fit is.
+    Parameters:
+        d_list(list of floats): the differences between the sample's scans.
+        indices(list of ints): the scan numbers of the scans used to generate d_list.
+        horizon(int): how many future scans to predict the noise level of.
+    Returns:
+        (numpy array of floats): the predicted noise levels of the scans after the last one in indices, in order.
+    """
+    params = fit_noise_decay(d_list, indices)
+    future = int(indices[-1]) + np.arange(1, horizon + 1, dtype=np.float64)
+    return noise(future, **params.valuesdict())
+
+
+def predict_cut_off(d_list, percent_of_log=0.4):
+    """
+    Purpose: Works out how low the average difference between the most recent scans has to fall for scanning to stop,
+    from the differences between the initial scans. Scanning stops once the log of the average of the most recent
+    differences falls below percent_of_log times the log of the average of the initial differences.
+    Parameters:
+        d_list(list of floats): the differences between the initial scans.
+        percent_of_log(optional float): default value is 0.4. See predict_num_scans.
+    Returns:
+        average(float): the average of the differences in d_list.
+        log_average(float): the natural log of average.
+        cut_off(float): the average difference at which scanning can stop, ie. exp(percent_of_log * log_average).
+    """
+    d_list = np.asarray(d_list, dtype=np.float64)
+    if len(d_list) == 0:
+        raise ValueError("At least two scans are required to work out a cut-off, as the cut-off is based on the "
+                         "differences between scans. Please try again with more scans.")
+    average = float(np.mean(d_list))
+    if not average > 0:
+        raise ValueError("The differences between the initial scans must average above 0 for their log to be taken, "
+                         "but they average " + str(average) + ". Please try again with different scans.")
+    log_average = float(np.log(average))
+    return average, log_average, float(np.exp(percent_of_log * log_average))
+
+
+def _forecast_levels(d_list, indices):
+    # The differences so far, followed by the noise levels forecast for the next MAX_PREDICTIONS scans.
+    return np.concatenate((np.asarray(d_list, dtype=np.float64), forecast_noise(d_list, indices, MAX_PREDICTIONS)))
+
+
+def _cut_off_scans(levels, cut_offs, window):
+    # The window starting at difference k ends with the difference between scans k + window - 1 and k + window,
+    # counting from 0, so a cut-off first reached by that window is reached at scan k + window + 1, counting from 1.
+    # -1 where a cut-off is never reached.
+    reached = first_at_or_below(rolling_mean(levels, window), cut_offs)
+    return np.where(reached < 0, -1, reached + window + 1)
+
+
+def additional_scans(cut_off_scan, scans_taken):
+    """
+    Purpose: The number of scans still to take once scans_taken have been taken, to reach the cut-off at cut_off_scan.
+    Parameters:
+        cut_off_scan(int or numpy array): the number of the scan at which the cut-off is reached, counting from 1.
+        scans_taken(int): the number of scans taken so far.
+    Returns:
+        (int or numpy array): cut_off_scan - scans_taken, or 0 if the cut-off has already been reached.
+    """
+    return np.maximum(cut_off_scan - scans_taken, 0)
+
+
+def find_cut_off(d_list, cut_off, indices=None, window=10):
+    """
+    Purpose: Finds the scan at which the average of the most recent differences first falls to the cut-off, using the
+    differences so far followed by the noise levels forecast from a single fit.
+    Parameters:
+        d_list(list of floats): the differences between the sample's scans so far.
+        cut_off(float): the average difference at which scanning can stop, as returned by predict_cut_off.
+        indices(optional list of ints): the scan numbers of the scans used to generate d_list. Default is 0, 1, 2, etc.
+        window(optional int): the number of recent differences averaged. Default value is 10.
+    Returns:
+        (tuple): the number of the scan at which the cut-off is reached, counting from 1, and a numpy array of the
+        differences (observed, then predicted) up to that scan.
+    """
+    if indices is None:
+        indices = list(range(len(d_list)))
+    levels = _forecast_levels(d_list, indices)
+    cut_off_scan = int(_cut_off_scans(levels, cut_off, window))
+    if cut_off_scan < 0:
+        raise RuntimeError("Sufficiently accurate prediction cannot be made.")
+    return cut_off_scan, levels[:cut_off_scan - 1]
+
+
+def sweep_cut_off(d_list, indices, percent_of_log, window=10, num_scans=10):
+    """
+    Purpose: Finds the number of additional scans needed for many values of percent_of_log at once, from a single
+    forecast of the noise levels, with the same search find_cut_off does for one.
+    Parameters:
+        d_list(list of floats): the differences between the sample's scans.
         indices(list of ints): the scan numbers of the scans used to generate d_list.
-        desired_noise(float): the variance between 5 consecutive scans the user would like to achieve, ie, we'll need to
-        continue scans until this level of variance is reached. Default is the highest variance among sample scans.
+        percent_of_log(list of floats): the values of percent_of_log to try. See predict_num_scans.
+        window(optional int): the number of recent differences averaged. Default value is 10.
+        num_scans(optional int): the number of scans taken, whose differences the cut-off is worked out from and
+        the forecast is made from. Default value is 10.
     Returns:
-         num_predictions+1(int): the number of scans required to reach the desired level of variance. Adding one
-         because, since we're working differences in d_list, and a difference comes from 2 values, to get any number of
-         differences you'll need that number of scans plus 1.
-    """
-    copied_indices = indices.copy()
-    num_predictions = 9
-    keep_predicting = True
-    recent_differences = d_list[:5]
-    variances = []
-    recent_variances = []
-    if len(d_list) < 9:
-        raise ValueError("Prediction can only be made with hdf5 file containing 10 or more scans. Less than 10 scans"
-                         " in the hdf5 file passed in. Please try again with an hdf5 file containing 10 or more scans.")
-    # Checking if the desired level of variance has already been reached in the first 10 scans.
-    for element in d_list:
-        if len(recent_differences) < 10:
-            recent_differences.append(element)
-        elif len(recent_differences) == 10:
-            recent_differences.append(element)
-            for var in recent_differences:
-                recent_variances.append(((var - np.mean(recent_differences)) ** 2))
-            if (np.sum(recent_variances) / len(recent_variances)) <= desired_difference:
-                return 0
-    # Predicting variances until we predict a variance that's at or below the desired level of variance.
-    while keep_predicting:
-        # Predicting the next difference.
-        predicted_level = predict(d_list, copied_indices)
-        copied_indices.append(int(copied_indices[-1]) + 1)
-        num_predictions = num_predictions + 1
-        # Adding the newly predicted differance to our list of variances.
-        d_list = np.append(d_list, predicted_level[-1])
-        # Calculating the variance of the newest differences.
-        recent_variances.clear()
-        recent_differences.pop(0)
-        recent_differences.append(predicted_level[-1])
-        for var in recent_differences:
-            recent_variances.append(((var - np.mean(recent_differences)) ** 2))
-        variances.append((np.sum(recent_variances)) / len(recent_variances))
-        # Stopping the predictions if the desired level of variance has already been reached.
-        if variances[-1] <= desired_difference:
-            keep_predicting = False
-        if num_predictions > 60:
-            # If the desired_difference was the default value, not input by user.
-            if desired_difference == 0.17961943:
-                raise RuntimeError("Sufficiently accurate prediction cannot be made.")
-            else:
-                raise ValueError("Desired level of variance cannot be reached.")
-    return num_predictions
-
-
-def determine_num_scans(d_list, indices, desired_difference):
+        table(dict): numpy arrays with one value per percent_of_log, under the keys 'percent_of_log', 'cut_off',
+        'cut_off_scan' and 'additional_scans' (as returned by additional_scans for the num_scans already taken). The
+        last two are NaN where the cut-off isn't reached within MAX_PREDICTIONS predicted scans. The whole series of
+        noise levels searched is under 'levels'.
+    """
+    percent_of_log = np.atleast_1d(np.asarray(percent_of_log, dtype=np.float64))
+    first = [item for item in d_list[: num_scans - 1]]
+    cut_offs = np.array([predict_cut_off(first, percent)[2] for percent in percent_of_log])
+    levels = _forecast_levels(first, list(indices[: num_scans - 1]))
+    cut_off_scan = _cut_off_scans(levels, cut_offs, window).astype(np.float64)
+    cut_off_scan[cut_off_scan < 0] = np.nan
+    return {
+        'percent_of_log': percent_of_log,
+        'cut_off': cut_offs,
+        'cut_off_scan': cut_off_scan,
+        'additional_scans': additional_scans(cut_off_scan, num_scans),
+        'levels': levels,
+    }
+
+
+def sweep_desired_difference(d_list, indices, desired_difference):
+    """
+    Purpose: Does what determine_num_scans does for many values of desired_difference at once, from a single forecast
+    of the noise levels.
+    Parameters:
+        d_list(list of floats): the differences between the sample's scans.
+        indices(list of ints): the scan numbers of the scans used to generate d_list.
+        desired_difference(list of floats): the values of desired_difference to try. See determine_num_scans.
+    Returns:
+        table(dict): numpy arrays with one value per desired_difference, under the keys 'desired_difference' and
+        'num_predictions' (as returned by determine_num_scans, or NaN where determine_num_scans would raise an error).
+    """
+    desired_difference = np.atleast_1d(np.asarray(desired_difference, dtype=np.float64))
+    recent_differences = np.array(list(d_list[:5]) + list(d_list[:6]), dtype=np.float64)
+    future = forecast_noise(d_list, indices, MAX_PREDICTIONS - 9)
+    # The variance before any predictions are made comes first, so a position of 0 means no more scans are needed.
+    variances = rolling_variance(np.concatenate((recent_differences, future)), len(recent_differences))
+    if len(d_list) <= 5:
+        variances[0] = np.inf
+    reached = first_at_or_below(variances, desired_difference)
+    num_predictions = np.where(reached < 0, np.nan, np.where(reached == 0, 0, 9 + reached))
+    return {'desired_difference': desired_difference, 'num_predictions': num_predictions}
+
+
+def sweep_thresholds(data, percent_of_log=None, desired_difference=None, num_scans=10, cache=True, engine='sgmdata'):
+    """
+    ### Description:
+    -----
+        Loads and interpolates a sample's scans once, and finds the number of additional scans needed for every one
+        of a set of thresholds, from a single forecast. Costs about the same as a single prediction.
+    ### Args:
+    -----
+        > **data** *(type: list of str)* -- The hdf5 files of the sample.
+        > **percent_of_log** *(type: optional list of floats)* -- The values of percent_of_log to try. See
+            sweep_cut_off.
+        > **desired_difference** *(type: optional list of floats)* -- The values of desired_difference to try. See
+            sweep_desired_difference.
+        > **num_scans** *(type: optional int)* -- Default value is 10. See predict_num_scans.
+        > **cache** *(type: optional InterpolationCache or boolean)* -- Default value is True. See check_sample_fitness.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". See check_sample_fitness.
+    ### Returns:
+    -----
+        >*(type: dict)*: 'sample', 'num_scans' and the interpolated scans as a ScanStack under 'stack', plus
+            'percent_of_log' and/or 'desired_difference' holding the table returned by sweep_cut_off or
+            sweep_desired_difference for the thresholds given.
+    """
+    if percent_of_log is None and desired_difference is None:
+        raise ValueError("At least one of percent_of_log and desired_difference must be given to sweep over.")
+    report = validate_scan_files(data)
+    num_scans = min(num_scans, len(report['scans']))
+    stack = check_sample_fitness(data, num_scans, report=report, cache=cache, engine=engine)
+    diff_list, indices = accumulate_scans(stack.sdd())
+    sweep = {'sample': report['sample'], 'num_scans': num_scans, 'stack': stack}
+    if percent_of_log is not None:
+        sweep['percent_of_log'] = sweep_cut_off(diff_list, indices, percent_of_log, num_scans=num_scans)
+    if desired_difference is not None:
+        sweep['desired_difference'] = sweep_desired_difference(diff_list, indices, desired_difference)
+    return sweep
+
+
+def determine_num_scans(d_list, indices, desired_difference, recorder=None):
     """
     ### Description:
     -----
@@ -125,88 +382,232 @@ def determine_num_scans(d_list, indices, desired_difference):
     ### Args:
     -----
         > **d_list** *(type: list of floats)* -- At this point, the list contains the average variance between noise
-        levels of the initial batch of scans provided by the user. During this function, the predicted levels of noise 
-        for future scans is added to this list. 
+        levels of the initial batch of scans provided by the user. The predicted levels of noise for future scans are
+        made from a single fit to this list, and searched for the first scan that reaches desired_difference.
         > **indices** *(type: list of ints)* -- The indexes of the initial batch of scans within d_list. So, if there 
         were 10 scans provided by the user initially, the list would contain the numbers 0-9.
         > **desired_noise** *(type: float)* -- the amnount of variance between 10 consecutive scans the user would like to
         achieve, ie, we'll need to continue scaning until this level of variance is reached.
+        > **recorder** *(type: optional StageRecorder)* -- Records the time taken by the forecast, and the number of
+        predictions searched.
     ### Returns:
     -----
         > **num_predictions + 1** *(type: int)*: The number of scans required to reach the user's desired level of variance, 
         plus 1. We add one, because we're working with the differences between 2 values.
     """
-    # Make a copy of the indices list to avoid modifying the original
-    copied_indices = indices.copy()
-    # Initialize variables
-    num_predictions = 9
-    keep_predicting = True
-    recent_differences = d_list[:5]
-    variances = []
-    recent_variances = []
-
-    # Iterate through the elements in d_list
-    for element in d_list:
-        if len(recent_differences) < 10:
-            recent_differences.append(element)
-        elif len(recent_differences) == 10:
-            recent_differences.append(element)
-    
-            # Calculate variances for the recent 10 differences        
-            for var in recent_differences:
-                recent_variances.append(((var - np.mean(recent_differences)) ** 2))
-
-            # If desired_difference already reached within initial 10 scans, function indicates that no more scans are needed
-            if (np.sum(recent_variances) / len(recent_variances)) <= desired_difference:
-                return 0
-
-    # Continue predicting until the desired level of variance is reached
-    while keep_predicting:
-        # Predict noise level for the next scan using predict() function
-        predicted_level = predict(d_list, copied_indices)
-        # Update indices and number of predictions
-        copied_indices.append(int(copied_indices[-1]) + 1)
-        num_predictions = num_predictions + 1
-        # Update d_list with predicted noise level
-        d_list = np.append(d_list, predicted_level[-1])
-        # Clear recent_variances and update recent_differences for next set of calculations
-        recent_variances.clear()
-        recent_differences.pop(0)
-        recent_differences.append(predicted_level[-1])
-        
-        # Calculate variances for most recent 10 differences
-        for var in recent_differences:
-            recent_variances.append(((var - np.mean(recent_differences)) ** 2))
-
-        # Calculate average variance for most recent 10 differences
-        variances.append((np.sum(recent_variances)) / len(recent_variances))
-        
-        # Check if the desired level of variance is reached
-        if variances[-1] <= desired_difference:
-            keep_predicting = False
-
-        # Check for a maximum number of predictions to avoid infinite loops
-        if num_predictions > 60:
-            if desired_difference == 0.17961943:
-                raise RuntimeError("Sufficiently accurate prediction cannot be made.")
-            else:
-                raise ValueError("Desired level of variance cannot be reached.")
+    # The window of recent differences starts out as the first 5 differences followed by the first 6, and keeps that
+    # length as predicted differences are pushed in.
+    recent_differences = np.array(list(d_list[:5]) + list(d_list[:6]), dtype=np.float64)
+
+    # If desired_difference already reached within initial 10 scans, function indicates that no more scans are needed
+    if len(d_list) > 5 and np.var(recent_differences) <= desired_difference:
+        return 0
+
+    # Predicting every noise level that could be needed from one fit. Predictions are counted from 9, and no more than
+    # MAX_PREDICTIONS can be made.
+    with (recorder or NULL_RECORDER).stage('forecast', horizon=MAX_PREDICTIONS - 9) as record:
+        future = forecast_noise(d_list, indices, MAX_PREDICTIONS - 9)
+        # variances[k] is the average variance of the most recent differences once k + 1 predictions have been made.
+        variances = rolling_variance(np.concatenate((recent_differences, future)), len(recent_differences))[1:]
+
+        # Searching for the first prediction at which the desired level of variance is reached
+        reached = np.flatnonzero(variances <= desired_difference)
+        record['steps'] = int(reached[0]) + 1 if reached.size else len(variances)
+    if reached.size == 0:
+        if desired_difference == DEFAULT_DESIRED_DIFFERENCE:
+            raise RuntimeError("Sufficiently accurate prediction cannot be made.")
+        else:
+            raise ValueError("Desired level of variance cannot be reached.")
 
     # Return the total number of predictions needed to reach the desired level of variance
-    return num_predictions
+    return 9 + int(reached[0]) + 1
 
 
-def predict_num_scans(data, verbose=False, percent_of_log=0.4, num_scans=10):
+def prediction_details(data, percent_of_log=0.4, num_scans=10, cache=True, engine='sgmdata', recorder=None):
     """
     ### Description:
     -----
-        Takes the SGMData object (an object containing information on a sample including information on the noise levels 
-        of the initial 10 scans of the sample) of a sample and uses a combination of other functions to predict how many 
+        Does the work of predict_num_scans, and returns everything worked out along the way rather than only the number
+        of additional scans.
+    ### Args:
+    -----
+        > **data** *(type: list of str)* -- The hdf5 files of the sample to predict the number of scans required for.
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **num_scans** *(type: optional int)* -- Default value is 10. See predict_num_scans.
+        > **cache** *(type: optional InterpolationCache or boolean)* -- Default value is True. See check_sample_fitness.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". See predict_num_scans.
+        > **recorder** *(type: optional StageRecorder)* -- See predict_num_scans.
+    ### Returns:
+    -----
+        >*(type: dict)*: With the keys 'sample', 'num_scans', 'stack' (the ScanStack of interpolated scans),
+            'diff_list', 'indices', 'average', 'log_average', 'cut_off', 'cut_off_scan', 'predicted' and
+            'additional_scans'.
+    """
+    recorder = recorder or NULL_RECORDER
+    # Use the validate_scan_files function to make sure the data provided by the user is suitable, before anything is
+    # loaded, and find the name of the sample from it.
+    with recorder.stage('validate') as record:
+        report = validate_scan_files(data)
+        record['files'] = len(report['files'])
+        record['scans'] = len(report['scans'])
+
+    # Make sure the correct number of scans are being interpreted
+    if num_scans >= (len(report['scans'])):
+        num_scans = len(report['scans'])
+    with recorder.stage('check_sample_fitness'):
+        stack = check_sample_fitness(data, num_scans, report=report, cache=cache, engine=engine, recorder=recorder)
+    return predict_from_stack(stack, percent_of_log, num_scans, recorder)
+
+
+def predict_from_stack(stack, percent_of_log=0.4, num_scans=10, recorder=None):
+    """
+    Purpose: Does the part of prediction_details that comes after the scans have been interpolated, so scans that are
+    already interpolated (eg. kept in memory between predictions) can be predicted from without loading them again.
+    Parameters:
+        stack(ScanStack): the sample's interpolated scans, as returned by check_sample_fitness.
+        percent_of_log(optional float): default value is 0.4. See predict_num_scans.
+        num_scans(optional int): default value is 10. The number of scans in stack to predict from.
+        recorder(optional StageRecorder): records the time and memory taken by each stage.
+    Returns:
+        (dict): as returned by prediction_details.
+    """
+    recorder = recorder or NULL_RECORDER
+    num_scans = min(num_scans, len(stack))
+    # Extract necessary data for prediction. The sdd channels are a view of the stack, so nothing is copied.
+    with recorder.stage('extract', shape=stack.data.shape, nbytes=stack.data.nbytes) as record:
+        diff_list, indices = accumulate_scans(stack.head(num_scans).sdd())
+        record['accepted'] = len(indices)
+    returned_diff_list_listed = [item for item in diff_list]
+    # Determine what amount variance between scans must be reached in order for sufficiently low noise levels
+    with recorder.stage('predict_cut_off'):
+        cut_off_point_info = predict_cut_off(returned_diff_list_listed[: num_scans - 1], percent_of_log)
+    # Determine how many scans must be taken in order to reach the sufficiently low noise level identified by predict_cut_off function
+    with recorder.stage('find_cut_off') as record:
+        number_of_scans = find_cut_off(returned_diff_list_listed[: num_scans - 1], cut_off_point_info[2],
+                                       indices[: num_scans - 1])
+        record['steps'] = len(number_of_scans[1])
+    return {
+        'sample': stack.sample,
+        'num_scans': num_scans,
+        'stack': stack,
+        'diff_list': diff_list,
+        'indices': indices,
+        'average': cut_off_point_info[0],
+        'log_average': cut_off_point_info[1],
+        'cut_off': cut_off_point_info[2],
+        'cut_off_scan': number_of_scans[0],
+        'predicted': number_of_scans[1],
+        'additional_scans': int(additional_scans(number_of_scans[0], num_scans)),
+    }
+
+
+def plot_predicted(scan_numbers, predicted, cut_off, stack, sample_type, num_scans, labels=None):
+    """
+    Purpose: Shows two graphs: the summed sdd values of the scans used for the prediction, and the differences between
+    scans (measured up to scan num_scans, predicted after it) along with the average of the most recent 10, up to the
+    scan at which that average reaches the cut-off. Each cut-off is drawn as a line, with a marker at the scan where
+    the average first reaches it, so the cut-offs of a whole sweep can be overlaid on one graph.
+    Parameters:
+        scan_numbers(list of ints): the scan numbers from num_scans up to the scan at which the cut-off is reached.
+        Empty if the cut-off was already reached within the first num_scans scans.
+        predicted(list of floats): the differences, measured then predicted, as returned by find_cut_off.
+        cut_off(float or list of floats): the cut-off, as returned by predict_cut_off, or the cut-offs of a sweep.
+        stack(ScanStack): the interpolated scans. The sdd channels of the first num_scans of them are summed and drawn
+        from one shared data source.
+        sample_type(str): the name of the sample, for the titles of the graphs.
+        num_scans(int): the number of scans the prediction was made from.
+        labels(optional list of str): the legend label of each cut-off. Default is "Cut-off" for every one.
+    """
+    from bokeh.io import show
+    from bokeh.layouts import column
+    from bokeh.models import ColumnDataSource
+    from bokeh.palettes import Viridis256
+    from bokeh.plotting import figure
+
+    shown = stack.head(num_scans).sdd()
+    source = ColumnDataSource({'xs': [shown.energy] * len(shown), 'ys': list(shown.data.sum(axis=2)),
+                               'scan': [index + 1 for index in shown.scan_indices]})
+    spectra = figure(title="Scans of " + str(sample_type), x_axis_label="Energy (eV)", y_axis_label="Summed sdd",
+                     tooltips=[("Scan", "@scan")])
+    spectra.multi_line(xs='xs', ys='ys', source=source, color='grey', alpha=0.5)
+
+    predicted = np.asarray(predicted, dtype=np.float64)
+    levels = figure(title="Predicted noise levels of " + str(sample_type), x_axis_label="Scan",
+                    y_axis_label="Difference", y_axis_type="log")
+    # The difference at position i is between scans i + 1 and i + 2, counting from 1.
+    scans = np.arange(len(predicted)) + 2
+    measured = scans <= num_scans
+    levels.scatter(x=scans[measured], y=predicted[measured], color='black', legend_label="Measured")
+    levels.scatter(x=scans[~measured], y=predicted[~measured], color='firebrick', legend_label="Predicted")
+    means = rolling_mean(predicted, 10)
+    levels.line(x=np.arange(len(means)) + 11, y=means, color='orange', legend_label="Average of the most recent 10")
+    cut_offs = np.atleast_1d(np.asarray(cut_off, dtype=np.float64))
+    labels = labels or ["Cut-off"] * len(cut_offs)
+    colours = ['red'] if len(cut_offs) == 1 else [Viridis256[int(i)] for i in np.linspace(0, 255, len(cut_offs))]
+    # The lines run to the last scan plotted, or on to the cut-off scan if that's further.
+    end = max([int(scans[-1])] + [int(scan) for scan in scan_numbers[-1:]])
+    reached = first_at_or_below(means, cut_offs)
+    for value, label, colour, position in zip(cut_offs, labels, colours, reached):
+        levels.line(x=[scans[0], end], y=[value, value], color=colour, line_dash='dashed', legend_label=label)
+        if position >= 0:
+            levels.scatter(x=[position + 11], y=[value], color=colour, size=8, legend_label=label)
+    levels.legend.click_policy = "hide"
+    show(column(spectra, levels))
+
+
+def _plotted_scans(stack, num_scans, budget, method):
+    # The sdd channels of the first num_scans scans, summed before thinning out so the budget is spent on the curves
+    # that are actually drawn.
+    stack = stack.head(num_scans).sdd()
+    stack = ScanStack(stack.data.sum(axis=2, keepdims=True), stack.energy, ['sdd'], stack.sample, stack.scan_indices)
+    return stack if budget is None else downsample_stack(stack, budget, method)
+
+
+def plot_prediction(details, budget=DEFAULT_POINT_BUDGET, method='minmax'):
+    """
+    Purpose: Plots the sample's scans and its predicted noise levels up to the cut-off, with plot_predicted.
+    Parameters:
+        details(dict): the details of the prediction, as returned by prediction_details.
+        budget(optional int): the most scan values plotted. The summed sdd values of the scans are thinned out to fit,
+        with downsample_stack. Default is DEFAULT_POINT_BUDGET. None plots every value.
+        method(optional str): "lttb" or "minmax". See downsample_stack. Default is "minmax".
+    """
+    num_scans = details['num_scans']
+    # Create a list of scan indices up to the total number of scans needed so that the predicted data can be plotted on a graph for the user
+    num_scans_listed = list(range(1, details['cut_off_scan'] + 1))
+    plot_predicted(num_scans_listed[num_scans - 1:], details['predicted'], details['cut_off'],
+                   _plotted_scans(details['stack'], num_scans, budget, method), details['sample'], num_scans)
+
+
+def plot_sweep(sweep, budget=DEFAULT_POINT_BUDGET, method='minmax'):
+    """
+    Purpose: Plots a sweep over percent_of_log with plot_predicted: the sample's scans, and its noise levels with the
+    cut-off of every percent_of_log tried overlaid, up to the scan at which the last of them is reached.
+    Parameters:
+        sweep(dict): as returned by sweep_thresholds, with a 'percent_of_log' table.
+        budget(optional int): see plot_prediction.
+        method(optional str): see plot_prediction.
+    """
+    table = sweep['percent_of_log']
+    num_scans = sweep['num_scans']
+    reached = table['cut_off_scan'][~np.isnan(table['cut_off_scan'])]
+    last = int(reached.max()) if reached.size else len(table['levels']) + 1
+    plot_predicted(list(range(num_scans, last + 1)), table['levels'][:last - 1], table['cut_off'],
+                   _plotted_scans(sweep['stack'], num_scans, budget, method), sweep['sample'], num_scans,
+                   ["percent_of_log " + str(percent) for percent in table['percent_of_log']])
+
+
+def predict_num_scans(data, verbose=False, percent_of_log=0.4, num_scans=10, engine='sgmdata', recorder=None):
+    """
+    ### Description:
+    -----
+        Takes the hdf5 files of a sample (files containing information on a sample including information on the noise
+        levels of the initial 10 scans of the sample) and uses a combination of other functions to predict how many
         additional scans should be taken of that sample.
     ### Args:
     -----
-        > **data** *(type: SGMData object)* -- The SGMData object for the sample the user would like the module to
-            predict the number of scans required for. 
+        > **data** *(type: list of str)* -- The hdf5 files of the sample the user would like the module to predict
+            the number of scans required for.
         > **verbose** *(type: optional boolean)* -- Default value is False. If set to True, gives user additional data
             on how the additional number of scans needed was calculated.
         > **percent_of_log** *(type: optional float)* -- Default value is 0.4. The level of noise that the user deems 
@@ -216,47 +617,29 @@ def predict_num_scans(data, verbose=False, percent_of_log=0.4, num_scans=10):
             by the log of the first ten averages, then scanning stops.
         > **num_scans** *(type: optional int)* -- Default value is 10. The number of scans from the scans provided by
             the user that the user would like to be used to predict the number of additional scans to take.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". How the scans are interpolated: "sgmdata"
+            uses SGMData.interpolate, and "native" bins the sdd signals straight from the hdf5 files with
+            native_interpolate, without making a dataframe for each scan.
+        > **recorder** *(type: optional StageRecorder)* -- Default value is None. If given, the wall time, CPU time,
+            memory use, array sizes and iteration counts of each stage of the prediction are added to its records.
     ### Returns:
     -----
         >*(type: int)*: The predicted number of additional scans that should be taken of a sample.
     """
-    # Use the check_sample_fitness function to make sure the data provided by the user is suitable.
-    interp_list = check_sample_fitness(data)
-    # Extract the necessary information from data provided by user
-    file = list(data.__dict__['scans'].keys())
-    sample_name = list(data.__dict__['scans'][file[0]].__dict__.keys())
-    sample_type = data.__dict__['scans'][file[0]].__getitem__(sample_name[0])['sample']
-
-    # Make sure the correct number of scans are being interpreted
-    if num_scans >= (len(interp_list)):
-        num_scans = len(interp_list)
-    
-    # Extract necessary data for prediction
-    returned_data = extracting_data(interp_list[:num_scans])
-    returned_diff_list_listed = [item for item in returned_data[0]]
-    # Determine what amount variance between scans must be reached in order for sufficiently low noise levels
-    cut_off_point_info = predict_cut_off(returned_diff_list_listed[: num_scans - 1], percent_of_log)
-    # Determine how many scans must be taken in order to reach the sufficiently low noise level identified by predict_cut_off function
-    number_of_scans = find_cut_off(returned_diff_list_listed[: num_scans - 1], cut_off_point_info[2])
-    # Create a list of scan indices up to the total number of scans needed so that the predicted data can be plotted on a graph for the user
-    i = 1
-    num_scans_listed = []
-    while i <= number_of_scans[0]:
-        num_scans_listed.append(i)
-        i += 1
+    details = prediction_details(data, percent_of_log, num_scans, engine=engine, recorder=recorder)
 
     # If the user has requested additional information (by setting the "Verbose" to true) additional data is provided in text and graph form
     if verbose:
         print(
             " *** Messages starting with \" ***\" are messages containing additional data, other than the number of "
-            "additional scans needed." + "\n *** Average of initial 10 values: " + str(cut_off_point_info[0]) +
-            "\n *** Log of average of initial 10 values: " + str(cut_off_point_info[1]) +
-            "\n *** Cut off val, based on log of average of initial 10 values: " + str(cut_off_point_info[2]) +
-            "\n *** Cut-off at scan number: " + str(number_of_scans[0]) +
-            "\n *** Value at scan " + str(number_of_scans[0]) + "(scans at which cut-off point is reached): " +
-            str(number_of_scans[1][-1]))
-        plot_predicted(num_scans_listed[num_scans - 1:], number_of_scans[1], cut_off_point_info[2], interp_list,
-                       sample_type, num_scans)
+            "additional scans needed." + "\n *** Average of initial 10 values: " + str(details['average']) +
+            "\n *** Log of average of initial 10 values: " + str(details['log_average']) +
+            "\n *** Cut off val, based on log of average of initial 10 values: " + str(details['cut_off']) +
+            "\n *** Cut-off at scan number: " + str(details['cut_off_scan']) +
+            "\n *** Value at scan " + str(details['cut_off_scan']) + "(scans at which cut-off point is reached): " +
+            str(details['predicted'][-1]))
+        with (recorder or NULL_RECORDER).stage('plot'):
+            plot_prediction(details)
 
     # Indicate the number of additional scans required for the sample
-    return number_of_scans[0] - 10
+    return details['additional_scans']
@@ -0,0 +1,8 @@
+"""
+### Overview: Default values of the prediction's settings that the command line needs before anything heavy is imported.
+They're kept here, apart from predict_num_scans, so predict_cli can show them in --help without importing numpy, lmfit
+or sgmdata.###
+"""
+
+# The variance determine_num_scans aims for when the user hasn't chosen one.
+DEFAULT_DESIRED_DIFFERENCE = 0.17961943
@@ -0,0 +1,351 @@
+"""
+### Overview: A long-running local service that answers "how many more scans?" without paying for process start-up,
+imports and re-opening hdf5 files on every prediction. It listens for HTTP requests on localhost, and keeps warm
+between requests: the modules stay imported, each file's metadata and open h5py handle are kept until the file
+changes, and the interpolated scans and results of recent predictions are kept in memory. Predictions run on a pool of
+worker threads, so concurrent requests for different samples are worked on at the same time, and concurrent requests
+for the same prediction share one run of it.
+
+Endpoints:
+    POST /predict  {"paths": [...], "percent_of_log": 0.4, "num_scans": 10, "engine": "native"}
+    POST /check    {"paths": [...]}
+    GET  /health
+    GET  /stats
+
+Usage:
+    python prediction_service.py --port 8765 --engine native --workers 4###
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import h5py
+
+from batch_predict import find_scan_files
+from predict_cli import summarise
+from predict_num_scans import check_sample_fitness, predict_from_stack, validate_scan_files
+from scan_index import default_index
+
+DEFAULT_PORT = 8765
+
+
+class PredictionService:
+    """
+    ### Description:
+    -----
+        Predicts the number of additional scans for samples, keeping whatever can be reused between predictions.
+    ### Args:
+    -----
+        > **workers** *(type: optional int)* -- The number of worker threads predictions run on. Default is the
+            ThreadPoolExecutor default.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". The engine used when a request doesn't ask
+            for one. See check_sample_fitness.
+        > **cache** *(type: optional InterpolationCache or boolean)* -- Default value is True. The on-disk cache used
+            by the "sgmdata" engine. See check_sample_fitness.
+        > **max_samples** *(type: optional int)* -- Default value is 32. The most samples whose interpolated scans and
+            results are kept in memory. The least recently used are dropped first, and the metadata and open handles
+            of their files go with them.
+    """
+
+    def __init__(self, workers=None, engine='sgmdata', cache=True, max_samples=32):
+        self.engine = engine
+        self.cache = cache
+        self.max_samples = max_samples
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='predict')
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # SGMData and the on-disk cache aren't safe to use from several threads at once.
+        self._sgmdata_lock = threading.Lock()
+        # Each of these is keyed by file name, and holds the file's (modification time, size) with the value, so a
+        # file that has been written to since (eg. a new scan added) is read again.
+        self._metadata = {}
+        self._handles = {}
+        self._stacks = OrderedDict()
+        self._results = OrderedDict()
+        self._pending = {}
+        self._counts = {'predict': 0, 'check': 0, 'errors': 0, 'result_hits': 0, 'stack_hits': 0, 'coalesced': 0,
+                        'computed': 0}
+        # Running totals rather than every latency, so a service that's up for weeks doesn't keep growing.
+        self._latency_total = 0.0
+        self._latency_max = None
+
+    @staticmethod
+    def _stat(filename):
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_file(self, filename):
+        stat = self._stat(filename)
+        known = self._metadata.get(filename)
+        if known and known[0] == stat:
+            return known[1]
+        scans = default_index().read_file(filename)
+        with self._lock:
+            self._metadata[filename] = (stat, scans)
+        return scans
+
+    def _handle(self, filename):
+        stat = self._stat(filename)
+        known = self._handles.get(filename)
+        if known and known[0] == stat:
+            return known[1]
+        # A handle to an older version of the file isn't closed here, as another worker may still be reading from it.
+        # h5py closes it once nothing refers to it any more.
+        h5 = h5py.File(filename, 'r')
+        with self._lock:
+            self._handles[filename] = (stat, h5)
+        return h5
+
+    def _remember(self, store, key, value):
+        with self._lock:
+            store[key] = value
+            store.move_to_end(key)
+            if len(store) > self.max_samples:
+                while len(store) > self.max_samples:
+                    store.popitem(last=False)
+                self._prune()
+
+    def _prune(self):
+        # Drops the metadata and closes the handles of files that no remembered or running prediction is from. Must be
+        # called with the lock held. A file in a running prediction is in one of the pending keys, so its handle is
+        # never closed while a worker is reading from it.
+        used = {entry[0] for key in list(self._stacks) + list(self._results) + list(self._pending) for entry in key[1]}
+        for filename in [filename for filename in self._metadata if filename not in used]:
+            del self._metadata[filename]
+        for filename in [filename for filename in self._handles if filename not in used]:
+            self._handles.pop(filename)[1].close()
+
+    def _predict(self, files, percent_of_log, num_scans, engine, key):
+        try:
+            report = validate_scan_files(files, self._read_file)
+            num_scans = min(num_scans, len(report['scans']))
+            stack_key = key[:2] + (num_scans,)
+            stack = self._stacks.get(stack_key)
+            if stack is not None:
+                self._count('stack_hits')
+            elif engine == 'native':
+                handles = {filename: self._handle(filename) for filename in {scan['file'] for scan in
+                                                                             report['scans'][:num_scans]}}
+                stack = check_sample_fitness(files, num_scans, report=report, engine=engine, handles=handles)
+            else:
+                with self._sgmdata_lock:
+                    stack = check_sample_fitness(files, num_scans, report=report, cache=self.cache, engine=engine)
+            self._remember(self._stacks, stack_key, stack)
+            result = summarise(predict_from_stack(stack, percent_of_log, num_scans))
+            result['files'] = len(files)
+            self._count('computed')
+            self._remember(self._results, key, result)
+        except Exception as e:
+            result = {'files': len(files), 'error': "{}: {}".format(type(e).__name__, e)}
+        return result
+
+    def _forget(self, key):
+        # Once a prediction is done, later requests get its remembered result, or run it again if it failed.
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _count(self, name, latency=None):
+        with self._lock:
+            self._counts[name] += 1
+            if latency is not None:
+                self._latency_total += latency
+                self._latency_max = latency if self._latency_max is None else max(self._latency_max, latency)
+
+    def predict(self, paths, percent_of_log=0.4, num_scans=10, engine=None):
+        """
+        Purpose: Predicts the number of additional scans needed for a sample, reusing an earlier prediction if none of
+        the sample's files have changed since.
+        Parameters:
+            paths(list of str): the sample's hdf5 files, directories or glob patterns.
+            percent_of_log(optional float): default value is 0.4. See predict_num_scans.
+            num_scans(optional int): default value is 10. See predict_num_scans.
+            engine(optional str): the engine to interpolate with. Default is the service's engine.
+        Returns:
+            (dict): as written by predict_cli, with an 'error' if the prediction failed.
+        """
+        start = time.perf_counter()
+        engine = engine or self.engine
+        files = find_scan_files([paths] if isinstance(paths, str) else paths)
+        try:
+            signature = tuple((filename,) + self._stat(filename) for filename in files)
+        except OSError as e:
+            signature = None
+            result = {'files': len(files), 'error': "{}: {}".format(type(e).__name__, e)}
+        if signature is not None:
+            key = (engine, signature, num_scans, percent_of_log)
+            submitted = False
+            with self._lock:
+                result = self._results.get(key)
+                future = self._pending.get(key)
+                if result is not None:
+                    self._counts['result_hits'] += 1
+                elif future is not None:
+                    self._counts['coalesced'] += 1
+                else:
+                    future = self.pool.submit(self._predict, files, percent_of_log, num_scans, engine, key)
+                    self._pending[key] = future
+                    submitted = True
+            if submitted:
+                # Added outside the lock, as a prediction that's already done calls it straight away.
+                future.add_done_callback(lambda _: self._forget(key))
+            if result is None:
+                result = future.result()
+        if 'error' in result:
+            self._count('errors')
+        self._count('predict', time.perf_counter() - start)
+        return dict(result)
+
+    def check(self, paths):
+        """
+        Purpose: Checks that a sample's files are suitable for predicting from, from their metadata alone.
+        Parameters:
+            paths(list of str): the sample's hdf5 files, directories or glob patterns.
+        Returns:
+            (dict): the 'sample', and the number of 'files' and 'scans', and the names of the 'sdd' signals, or an
+            'error' saying why the files aren't suitable.
+        """
+        start = time.perf_counter()
+        files = find_scan_files([paths] if isinstance(paths, str) else paths)
+        try:
+            report = validate_scan_files(files, self._read_file)
+            result = {'sample': report['sample'], 'files': len(files), 'scans': len(report['scans']),
+                      'sdd': report['sdd']}
+        except (OSError, ValueError) as e:
+            result = {'files': len(files), 'error': "{}: {}".format(type(e).__name__, e)}
+            self._count('errors')
+        with self._lock:
+            # Files only ever checked aren't kept, as they'd otherwise never be dropped.
+            self._prune()
+        self._count('check', time.perf_counter() - start)
+        return result
+
+    def health(self):
+        """Returns the service's status, for a quick check that it's up."""
+        return {'status': 'ok', 'uptime': time.time() - self.started, 'pending': len(self._pending)}
+
+    def stats(self):
+        """
+        Purpose: Reports how much work the service has done, and how much of it was saved by what it keeps.
+        Returns:
+            (dict): the number of 'predict' and 'check' requests, 'errors', 'result_hits' (answered from an earlier
+            result), 'stack_hits' (predicted from scans already interpolated), 'coalesced' (shared a prediction
+            already running) and 'computed' predictions, the 'throughput' in requests per second since start-up, the
+            'mean_latency' and 'max_latency' of requests in seconds, and the number of 'open_files', 'cached_samples'
+            and 'pending' predictions.
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            latency_total = self._latency_total
+            stats['max_latency'] = self._latency_max
+            stats.update({
+                'open_files': len(self._handles),
+                'cached_samples': len(self._stacks),
+                'pending': len(self._pending),
+            })
+        uptime = time.time() - self.started
+        stats['uptime'] = uptime
+        stats['throughput'] = (stats['predict'] + stats['check']) / uptime if uptime else 0.0
+        requests = stats['predict'] + stats['check']
+        stats['mean_latency'] = latency_total / requests if requests else None
+        return stats
+
+    def close(self):
+        """Waits for the predictions that are running, then closes every file the service has open."""
+        self.pool.shutdown(wait=True)
+        with self._lock:
+            for _, h5 in self._handles.values():
+                h5.close()
+            self._handles.clear()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    routes = {
+        ('GET', '/health'): 'health',
+        ('GET', '/stats'): 'stats',
+        ('POST', '/predict'): 'predict',
+        ('POST', '/check'): 'check',
+    }
+
+    def _handle(self, method):
+        name = self.routes.get((method, self.path.split('?', 1)[0]))
+        if name is None:
+            return self._reply(404, {'error': "Unknown endpoint: {} {}".format(method, self.path)})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            arguments = json.loads(self.rfile.read(length) or b'{}') if method == 'POST' else {}
+            result = getattr(self.server.service, name)(**arguments)
+        except (TypeError, ValueError) as e:
+            # The body wasn't JSON, or didn't hold the arguments the endpoint takes.
+            return self._reply(400, {'error': "{}: {}".format(type(e).__name__, e)})
+        self._reply(422 if 'error' in result else 200, result)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """
+    ### Description:
+    -----
+        The HTTP server in front of a PredictionService. Each request is handled on its own thread.
+    ### Args:
+    -----
+        > **address** *(type: tuple)* -- The (host, port) to listen on.
+        > **service** *(type: PredictionService)* -- The service that answers the requests.
+        > **verbose** *(type: optional boolean)* -- Default value is False. If set to True, every request is logged.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, _RequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve predictions of the number of additional scans needed.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-w', '--workers', type=int, help="number of worker threads")
+    parser.add_argument('--engine', choices=('sgmdata', 'native'), default='sgmdata',
+                        help="engine used when a request doesn't ask for one (default: sgmdata)")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the on-disk interpolation cache")
+    parser.add_argument('--max-samples', type=int, default=32, help="samples kept in memory (default: 32)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+    service = PredictionService(args.workers, args.engine, not args.no_cache, args.max_samples)
+    server = PredictionServer((args.host, args.port), service, args.verbose)
+    print("Serving predictions on http://{}:{}/".format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+### Overview: An on-disk cache of interpolated scans. Interpolating a sample's scans is the slowest part of predicting
+the number of scans it needs, and it gives the same result every time it's run on the same file. Each interpolated
+scan's sdd values are saved here as a .npy file, keyed by the content of the hdf5 file it came from, the scan entry,
+the resolution and the sdd signals, and read back memory-mapped the next time they're needed. Once the cache grows past
+its size cap, the scans that were used least recently are removed.###
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Where the cache is kept if no directory is given. Can be overridden with the PNS_CACHE_DIR environment variable.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'predict_num_scans')
+# How large the cache can grow before the least recently used scans are removed, in bytes.
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_HASH_CHUNK = 1024 ** 2
+_HASHES_FILE = 'file_hashes.json'
+
+
+class InterpolationCache:
+    """
+    ### Description:
+    -----
+        A directory of interpolated scans, each stored as a .npy file of the scan's energy values followed by its sdd
+        values, with a .json file alongside it holding the column names.
+    ### Args:
+    -----
+        > **directory** *(type: optional str)* -- Where to keep the cache. Default is the PNS_CACHE_DIR environment
+            variable if it's set, otherwise DEFAULT_CACHE_DIR.
+        > **max_bytes** *(type: optional int)* -- Default value is DEFAULT_MAX_BYTES. How large the cache can grow
+            before the least recently used scans are removed.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.environ.get('PNS_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._hashes = self._load_hashes()
+
+    def _load_hashes(self):
+        try:
+            with open(os.path.join(self.directory, _HASHES_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _replace(self, path, write, mode='w'):
+        # Writes to a temporary file of its own and then moves it into place, so processes sharing the cache (eg.
+        # batch_predict's workers) never read a half-written file or move each other's temporary files.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _save_hashes(self):
+        # Other processes may have hashed other files since this one loaded the hashes, so theirs are kept too.
+        hashes = self._load_hashes()
+        hashes.update(self._hashes)
+        self._hashes = hashes
+        try:
+            self._replace(os.path.join(self.directory, _HASHES_FILE), lambda f: json.dump(hashes, f))
+        except OSError:
+            # The hashes are only remembered to save rehashing files, so losing them costs time, not correctness.
+            pass
+
+    def file_hash(self, filename):
+        """
+        Purpose: Finds the sha256 hash of a file's contents. The hash is remembered along with the file's size and
+        modification time, so the file is only read again once it has changed.
+        Parameters:
+            filename(str): the file to hash.
+        Returns:
+            (str): the hex digest of the file's contents.
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        known = self._hashes.get(path)
+        if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                digest.update(chunk)
+        self._hashes[path] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+        self._save_hashes()
+        return digest.hexdigest()
+
+    def key(self, filename, entry, resolution, sdd):
+        """
+        Purpose: Makes the key an interpolated scan is stored under.
+        Parameters:
+            filename(str): the hdf5 file the scan is in.
+            entry(str): the scan's entry within the file.
+            resolution(float): the resolution the scan was interpolated at.
+            sdd(list of str): the names of the sdd signals kept from the scan.
+        Returns:
+            (str): the key.
+        """
+        parts = [self.file_hash(filename), entry, repr(float(resolution))] + sorted(sdd)
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.npy', base + '.json'
+
+    def get(self, key):
+        """
+        Purpose: Reads an interpolated scan from the cache.
+        Parameters:
+            key(str): the key the scan was stored under.
+        Returns:
+            (pandas dataframe or None): the scan's sdd values, indexed by energy and backed by a memory-mapped array,
+            or None if the scan isn't in the cache.
+        """
+        array_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            values = np.load(array_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        # Marking the scan as recently used. Another process may have just evicted it, which is fine, as it's
+        # already been opened.
+        try:
+            os.utime(array_path)
+        except OSError:
+            pass
+        import pandas
+        return pandas.DataFrame(values[:, 1:], index=pandas.Index(values[:, 0], name=meta['index']),
+                                columns=meta['columns'], copy=False)
+
+    def put(self, key, df):
+        """
+        Purpose: Stores an interpolated scan in the cache, then removes the least recently used scans if the cache has
+        grown past max_bytes.
+        Parameters:
+            key(str): the key to store the scan under.
+            df(pandas dataframe): the scan's sdd values, indexed by energy.
+        """
+        array_path, meta_path = self._paths(key)
+        values = np.column_stack((df.index.to_numpy(dtype=np.float64), df.to_numpy(dtype=np.float64)))
+        meta = {'index': df.index.name, 'columns': [str(column) for column in df.columns]}
+        self._replace(meta_path, lambda f: json.dump(meta, f))
+        self._replace(array_path, lambda f: np.save(f, values), 'wb')
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used scans until the cache is no larger than max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    # Evicted by another process in the meantime.
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name[:-4]))
+                total += stat.st_size
+        entries.sort()
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Returns the InterpolationCache used when check_sample_fitness is asked to use a cache without being given one."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = InterpolationCache()
+    return _default_cache
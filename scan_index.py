@@ -0,0 +1,223 @@
+"""
+### Overview: An index of what is in SGM hdf5 files, kept in a small SQLite file so each hdf5 file only has to be
+visited once. The scan entries, sample names and signals (with their dataset paths, shapes and dtypes) of every file
+are recorded along with the file's modification time and size, and a file is only read again once either changes.
+Grouping files by sample, checking for sdd signals and finding the datasets of particular channels are then lookups in
+the index, which stays fast across directories with thousands of scan files.###
+"""
+import json
+import os
+import sqlite3
+import threading
+
+from scan_cache import DEFAULT_CACHE_DIR
+from scan_metadata import read_file_metadata, read_scan_metadata
+
+# The name of the index file within the cache directory.
+INDEX_FILE = 'scan_index.sqlite'
+# The most file names put into one "IN (...)" query, to stay under SQLite's limit on parameters.
+_QUERY_CHUNK = 500
+
+# Bumped whenever what's recorded for a file changes (eg. the order of its entries), so older indexes are rebuilt.
+_SCHEMA_VERSION = 2
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, error TEXT);
+CREATE TABLE IF NOT EXISTS scans (file TEXT, position INTEGER, entry TEXT, sample TEXT, PRIMARY KEY (file, position));
+CREATE TABLE IF NOT EXISTS signals (file TEXT, position INTEGER, name TEXT, path TEXT, shape TEXT, dtype TEXT);
+CREATE INDEX IF NOT EXISTS signals_file ON signals (file, position);
+CREATE INDEX IF NOT EXISTS signals_name ON signals (name);
+"""
+
+
+class ScanIndex:
+    """
+    ### Description:
+    -----
+        The index of the scan entries and signals in a set of hdf5 files. Files are indexed the first time they're
+        asked about, and indexed again whenever their modification time or size has changed.
+    ### Args:
+    -----
+        > **path** *(type: optional str)* -- The SQLite file to keep the index in. Default is INDEX_FILE within the
+            PNS_CACHE_DIR environment variable if it's set, otherwise within DEFAULT_CACHE_DIR. Use ":memory:" for an
+            index that isn't saved.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            directory = os.environ.get('PNS_CACHE_DIR', DEFAULT_CACHE_DIR)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, INDEX_FILE)
+        self.path = path
+        # The connection is shared by every thread using the index (eg. the prediction service's workers), one at a
+        # time.
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS scans; "
+                                   "DROP TABLE IF EXISTS signals; PRAGMA user_version = {};".format(_SCHEMA_VERSION))
+        self._db.executescript(_SCHEMA)
+
+    def _rows(self, sql, files, *args):
+        # Runs a query of the form "... WHERE file IN ({})" over every file, a chunk at a time.
+        rows = []
+        for start in range(0, len(files), _QUERY_CHUNK):
+            chunk = files[start:start + _QUERY_CHUNK]
+            rows.extend(self._db.execute(sql.format(','.join('?' * len(chunk))), list(chunk) + list(args)))
+        return rows
+
+    def refresh(self, list_of_files):
+        """
+        Purpose: Indexes the files that aren't in the index yet or have changed since they were indexed.
+        Parameters:
+            list_of_files(list of str): the hdf5 files to bring up to date.
+        Returns:
+            (list of str): the absolute paths of the files, in the order given. Files that no longer exist are
+            removed from the index.
+        """
+        paths = [os.path.abspath(filename) for filename in list_of_files]
+        with self._lock:
+            known = {row[0]: row[1:] for row in self._rows("SELECT file, mtime_ns, size FROM files WHERE file IN ({})",
+                                                           sorted(set(paths)))}
+            with self._db:
+                for path in dict.fromkeys(paths):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        if path in known:
+                            self._forget(path)
+                        continue
+                    if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                        self._index(path, stat)
+        return paths
+
+    def _forget(self, path):
+        for table in ('files', 'scans', 'signals'):
+            self._db.execute("DELETE FROM {} WHERE file = ?".format(table), (path,))
+
+    def _index(self, path, stat):
+        self._forget(path)
+        try:
+            scans = read_file_metadata(path)
+            error = None
+        except (OSError, ValueError) as e:
+            # Files that can't be read are remembered too, so they aren't tried again until they change.
+            scans = []
+            error = str(e)
+        self._db.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (path, stat.st_mtime_ns, stat.st_size, error))
+        for position, scan in enumerate(scans):
+            self._db.execute("INSERT INTO scans VALUES (?, ?, ?, ?)", (path, position, scan['entry'], scan['sample']))
+            self._db.executemany("INSERT INTO signals VALUES (?, ?, ?, ?, ?, ?)", [
+                (path, position, name, signal['path'], json.dumps(signal['shape']), signal['dtype'])
+                for name, signal in scan['signals'].items()
+            ])
+
+    def read_file(self, filename):
+        """
+        Purpose: Lists the scan entries of one hdf5 file from the index, indexing the file first if it's new or has
+        changed. Can be passed as the read_file of read_scan_metadata or validate_scan_files.
+        Parameters:
+            filename(str): the hdf5 file.
+        Returns:
+            (list of dicts): as returned by read_file_metadata, with 'file' being filename as given.
+        """
+        with self._lock:
+            path = self.refresh([filename])[0]
+            return self._load(path, filename)
+
+    def _load(self, path, filename):
+        row = self._db.execute("SELECT error FROM files WHERE file = ?", (path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError("No such file: " + repr(filename))
+        if row[0] is not None:
+            raise OSError(row[0])
+        scans = [{'file': filename, 'entry': entry, 'sample': sample, 'signals': {}}
+                 for entry, sample in self._db.execute("SELECT entry, sample FROM scans WHERE file = ? "
+                                                       "ORDER BY position", (path,))]
+        for position, name, dataset, shape, dtype in self._db.execute(
+                "SELECT position, name, path, shape, dtype FROM signals WHERE file = ? ORDER BY rowid", (path,)):
+            scans[position]['signals'][name] = {'path': dataset, 'shape': tuple(json.loads(shape)), 'dtype': dtype}
+        return scans
+
+    def read_scan_metadata(self, list_of_files):
+        """
+        Purpose: Builds the same report as scan_metadata.read_scan_metadata, from the index. All the files are brought
+        up to date in one go first.
+        Parameters:
+            list_of_files(list of str): the hdf5 files to report on.
+        Returns:
+            (dict): the report. See scan_metadata.read_scan_metadata.
+        """
+        files = list(list_of_files)
+        with self._lock:
+            paths = dict(zip(files, self.refresh(files)))
+            return read_scan_metadata(files, lambda filename: self._load(paths[filename], filename))
+
+    def group_by_sample(self, list_of_files):
+        """
+        Purpose: Groups hdf5 files by the sample their scans are from, with a single lookup in the index.
+        Parameters:
+            list_of_files(list of str): the hdf5 files to group.
+        Returns:
+            groups(dict): the files of each sample, keyed by sample name, in the order the files were given. A file
+            whose scans are from more than one sample is grouped under its first sample.
+            unreadable(dict): the error message of each file that couldn't be read or has no scans, keyed by file name.
+        """
+        files = list(list_of_files)
+        with self._lock:
+            paths = self.refresh(files)
+            samples = dict(self._rows("SELECT file, sample FROM scans WHERE position = 0 AND file IN ({})", paths))
+            errors = dict(self._rows("SELECT file, error FROM files WHERE error IS NOT NULL AND file IN ({})", paths))
+        groups = {}
+        unreadable = {}
+        for filename, path in zip(files, paths):
+            if path in samples:
+                groups.setdefault(samples[path], []).append(filename)
+            else:
+                unreadable[filename] = errors.get(path, "File does not contain any scans.")
+        return groups, unreadable
+
+    def find_signals(self, list_of_files, pattern='sdd'):
+        """
+        Purpose: Finds the datasets of the signals whose names contain pattern, in every scan of the files.
+        Parameters:
+            list_of_files(list of str): the hdf5 files to look in.
+            pattern(optional str): the text the signal names must contain. Default value is "sdd".
+        Returns:
+            (list of dicts): one per matching signal, in file and scan order, with the keys 'file' (as given), 'entry',
+            'sample', 'name', 'path', 'shape' and 'dtype'.
+        """
+        files = list(list_of_files)
+        with self._lock:
+            paths = self.refresh(files)
+            rows = self._rows("SELECT signals.file, entry, sample, name, path, shape, dtype FROM signals "
+                              "JOIN scans USING (file, position) WHERE signals.file IN ({}) AND instr(name, ?) > 0 "
+                              "ORDER BY scans.position, signals.rowid", paths, pattern)
+        by_file = {}
+        for row in rows:
+            by_file.setdefault(row[0], []).append(row)
+        signals = []
+        for filename, path in zip(files, paths):
+            # A file given more than once is only listed the first time.
+            for _, entry, sample, name, dataset, shape, dtype in by_file.pop(path, ()):
+                signals.append({'file': filename, 'entry': entry, 'sample': sample, 'name': name, 'path': dataset,
+                                'shape': tuple(json.loads(shape)), 'dtype': dtype})
+        return signals
+
+    def close(self):
+        """Closes the index's SQLite file."""
+        self._db.close()
+
+
+_default_index = None
+_default_index_pid = None
+
+
+def default_index():
+    """Returns the ScanIndex used when no other is given."""
+    global _default_index, _default_index_pid
+    # A SQLite connection can't be shared with a forked process (eg. batch_predict's workers), so each process opens
+    # its own.
+    if _default_index is None or _default_index_pid != os.getpid():
+        _default_index = ScanIndex()
+        _default_index_pid = os.getpid()
+    return _default_index
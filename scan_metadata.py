@@ -0,0 +1,115 @@
+"""
+### Overview: Reads what is in a set of SGM hdf5 files without reading the scans themselves. Only group names, dataset
+names, shapes, dtypes and the sample name of each scan entry are read, so a batch of files can be checked for the
+things predict_num_scans needs (scans, sdd signals, a single sample) before anything is loaded or interpolated.###
+"""
+import re
+
+import h5py
+
+# Where the name of the sample is kept within a scan entry, in the order they're looked for.
+SAMPLE_PATHS = ('sample/name', 'sample/description')
+
+
+def _as_str(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if hasattr(value, 'item'):
+        return _as_str(value.item())
+    return str(value)
+
+
+def _is_entry(name, group):
+    nx_class = group.attrs.get('NX_class', b'')
+    return _as_str(nx_class) == 'NXentry' or name.startswith('entry')
+
+
+def _entry_order(name):
+    # h5py lists groups in name order, which puts entry10 before entry2. Entries are put back in the order they were
+    # taken by the number at the end of their name, with any entries without one after them in name order.
+    match = re.search(r'(\d+)$', name)
+    return (0, int(match.group(1)), name) if match else (1, 0, name)
+
+
+def _sample_name(entry):
+    for path in SAMPLE_PATHS:
+        if path in entry:
+            return _as_str(entry[path][()])
+    if 'sample' in entry.attrs:
+        return _as_str(entry.attrs['sample'])
+    return None
+
+
+def _signals(entry):
+    signals = {}
+
+    def visit(path, obj):
+        # Only the dataset's description is looked at here, so none of its values are read from disk.
+        if isinstance(obj, h5py.Dataset) and not path.startswith('sample'):
+            signals.setdefault(path.rsplit('/', 1)[-1], {
+                'path': entry.name + '/' + path,
+                'shape': tuple(obj.shape),
+                'dtype': str(obj.dtype),
+            })
+
+    entry.visititems(visit)
+    return signals
+
+
+def read_file_metadata(filename):
+    """
+    ### Description:
+    -----
+        Lists the scan entries of one hdf5 file, with the sample name and signals of each.
+    ### Args:
+    -----
+        > **filename** *(type: str)* -- The hdf5 file to read.
+    ### Returns:
+    -----
+        >*(type: list of dicts)*: One dict per scan entry, in the order the scans were taken, with the keys 'file',
+            'entry', 'sample' and 'signals'.
+            'signals' maps each signal name to its dataset 'path', 'shape' and 'dtype'.
+    """
+    scans = []
+    with h5py.File(filename, 'r') as h5:
+        for name in sorted(h5.keys(), key=_entry_order):
+            group = h5[name]
+            if isinstance(group, h5py.Group) and _is_entry(name, group):
+                scans.append({
+                    'file': filename,
+                    'entry': name,
+                    'sample': _sample_name(group),
+                    'signals': _signals(group),
+                })
+    return scans
+
+
+def read_scan_metadata(list_of_files, read_file=read_file_metadata):
+    """
+    ### Description:
+    -----
+        Builds a report of what the hdf5 files in list_of_files contain, without loading any signal arrays.
+    ### Args:
+    -----
+        > **list_of_files** *(type: list of str)* -- The hdf5 files to report on.
+        > **read_file** *(type: optional function)* -- Default is read_file_metadata. Lists the scan entries of one
+            file, in the same form as read_file_metadata. Lets a caller that has already read a file supply its
+            metadata without opening the file again.
+    ### Returns:
+    -----
+        >*(type: dict)*: The report, with the keys:
+            'files' -- the files that were read, in order.
+            'scans' -- one dict per scan entry, in file order, as returned by read_file_metadata.
+            'samples' -- the distinct sample names found, in the order they first appear.
+            'sdd' -- the names of the sdd signals in the first scan entry.
+    """
+    files = list(list_of_files)
+    scans = []
+    for filename in files:
+        scans.extend(read_file(filename))
+    samples = []
+    for scan in scans:
+        if scan['sample'] not in samples:
+            samples.append(scan['sample'])
+    sdd = [name for name in scans[0]['signals'] if 'sdd' in name] if scans else []
+    return {'files': files, 'scans': scans, 'samples': samples, 'sdd': sdd}
@@ -0,0 +1,131 @@
+"""
+### Overview: ScanStack holds every interpolated scan of a sample in one (scans x energies x channels) array, along with
+the sample name, the scan numbers, the energy grid and the channel names. Taking the first few scans or a set of
+channels gives a view of the same array rather than a copy, so the sdd values can be handed to the prediction without
+being copied out of a dataframe for each scan.###
+"""
+import re
+
+import numpy as np
+
+
+class ScanStack:
+    """
+    ### Description:
+    -----
+        The interpolated scans of one sample.
+    ### Args:
+    -----
+        > **data** *(type: numpy array)* -- The scans' values, of shape scans x energies x channels. Can be a memory-
+            mapped array.
+        > **energy** *(type: numpy array)* -- The energy grid the scans were interpolated onto.
+        > **channels** *(type: list of str)* -- The name of each channel.
+        > **sample** *(type: optional str)* -- The name of the sample the scans are from.
+        > **scan_indices** *(type: optional list of ints)* -- The number of each scan. Default is 0, 1, 2, etc.
+    """
+    __slots__ = ('data', 'energy', 'channels', 'sample', 'scan_indices')
+
+    def __init__(self, data, energy, channels, sample=None, scan_indices=None):
+        if data.ndim != 3 or data.shape[1:] != (len(energy), len(channels)):
+            raise ValueError("data must have the shape scans x energies x channels, "
+                             + str((len(energy), len(channels))) + " for the energies and channels given, not "
+                             + str(data.shape) + ".")
+        self.data = data
+        self.energy = energy
+        self.channels = list(channels)
+        self.sample = sample
+        self.scan_indices = list(range(len(data))) if scan_indices is None else list(scan_indices)
+
+    @classmethod
+    def allocate(cls, num_scans, energy, channels, sample=None, dtype=np.float64, filename=None):
+        """
+        Purpose: Makes a ScanStack with room for num_scans scans, to be filled in one scan at a time.
+        Parameters:
+            num_scans(int): the number of scans.
+            energy(numpy array): the energy grid the scans are interpolated onto.
+            channels(list of str): the name of each channel.
+            sample(optional str): the name of the sample.
+            dtype(optional numpy dtype): the dtype of the values. Default is float64.
+            filename(optional str): if given, the values are kept in a memory-mapped .npy file of this name instead of
+            in memory.
+        Returns:
+            (ScanStack): the stack, with its values not yet filled in.
+        """
+        shape = (num_scans, len(energy), len(channels))
+        if filename is None:
+            data = np.empty(shape, dtype=dtype)
+        else:
+            data = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        return cls(data, np.asarray(energy), channels, sample)
+
+    @classmethod
+    def from_frames(cls, frames, sample=None, dtype=np.float64, filename=None):
+        """
+        Purpose: Copies a list of interpolated dataframes, such as the one returned by SGMData.interpolate, into a
+        ScanStack. The sdd columns are put first, so they can be selected without copying.
+        Parameters:
+            frames(list of pandas dataframes): the scans, indexed by energy. They must all have the same energies.
+            sample(optional str): the name of the sample.
+            dtype(optional numpy dtype): the dtype of the values. Default is float64.
+            filename(optional str): see allocate.
+        Returns:
+            (ScanStack): the stack.
+        """
+        columns = [str(column) for column in frames[0].columns]
+        channels = [c for c in columns if re.search("sdd.*", c)] + [c for c in columns if not re.search("sdd.*", c)]
+        stack = cls.allocate(len(frames), frames[0].index.to_numpy(), channels, sample, dtype, filename)
+        for i, df in enumerate(frames):
+            if len(df) != len(stack.energy):
+                raise ValueError("The scans must all be interpolated onto the same energies to be stacked. Scan "
+                                 + str(i) + " has " + str(len(df)) + " energies rather than "
+                                 + str(len(stack.energy)) + ".")
+            names = {str(column): column for column in df.columns}
+            stack.data[i] = df[[names[c] for c in channels]].to_numpy(dtype=dtype)
+        return stack
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        # Each scan is a view of the stack's array, of shape energies x channels.
+        return iter(self.data)
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def _view(self, data, channels=None, scan_indices=None):
+        return ScanStack(data, self.energy, self.channels if channels is None else channels, self.sample,
+                         self.scan_indices if scan_indices is None else scan_indices)
+
+    def head(self, num_scans):
+        """Returns a view of the first num_scans scans."""
+        return self._view(self.data[:num_scans], scan_indices=self.scan_indices[:num_scans])
+
+    def select(self, channels):
+        """
+        Purpose: Selects some of the channels of the scans.
+        Parameters:
+            channels(str or list of str): a regular expression the names of the channels must contain a match for,
+            or a list of channel names.
+        Returns:
+            (ScanStack): the selected channels. It's a view of this stack if the channels are next to each other,
+            which the sdd channels always are, and a copy otherwise.
+        """
+        if isinstance(channels, str):
+            positions = [i for i, name in enumerate(self.channels) if re.search(channels, name)]
+        else:
+            positions = [self.channels.index(name) for name in channels]
+        names = [self.channels[i] for i in positions]
+        if positions and positions == list(range(positions[0], positions[-1] + 1)):
+            return self._view(self.data[:, :, positions[0]:positions[-1] + 1], names)
+        return self._view(self.data[:, :, positions], names)
+
+    def sdd(self):
+        """Returns the sdd channels of the scans."""
+        return self.select("sdd.*")
+
+    def to_frames(self):
+        """Returns a pandas dataframe for each scan, indexed by energy, as SGMData.interpolate does."""
+        import pandas
+        index = pandas.Index(self.energy, name='en')
+        return [pandas.DataFrame(scan, index=index, columns=self.channels, copy=False) for scan in self.data]
@@ -0,0 +1,219 @@
+"""
+### Overview: Streaming statistics used while combining sample scans. Rather than stacking every scan's sdd array and
+re-averaging the whole stack each time a scan arrives, the accumulator here keeps a single running mean (and, on
+request, a Welford-style running variance) and updates it in place, so each scan costs the same amount of work no
+matter how many scans came before it.###
+"""
+import numpy as np
+
+# If the variance of a new scan's difference is this much larger than the previous one, the scan is rejected.
+JUMP_LIMIT = -50
+
+
+class ScanAccumulator:
+    """
+    ### Description:
+    -----
+        Running mean of the sdd arrays of a sample's scans. Each pushed scan is compared against the current mean, and
+        the variance of the change it would make to the mean is recorded in diff_list. A scan whose variance jumps by
+        more than 50 over the previous accepted scan is rolled back: it is not added to the mean and its difference is
+        discarded, matching the rule used by interpolating_data.
+    ### Args:
+    -----
+        > **track_variance** *(type: optional boolean)* -- Default value is False. If set to True, a second buffer is
+            kept with the running sum of squared deviations, so the per-point variance across accepted scans is
+            available through the variance property.
+    """
+    __slots__ = ('mean', 'count', 'pushed', 'indices', 'track_variance', '_diffs', '_m2')
+
+    def __init__(self, track_variance=False):
+        self.mean = None
+        self.count = 0
+        self.pushed = 0
+        self.indices = []
+        self.track_variance = track_variance
+        self._diffs = []
+        self._m2 = None
+
+    def push(self, arr):
+        """
+        ### Description:
+        -----
+            Adds one scan's sdd array to the running mean, unless it fails the jump rule.
+        ### Args:
+        -----
+            > **arr** *(type: numpy array)* -- The sdd values of the scan. Must have the same shape as the first scan.
+        ### Returns:
+        -----
+            >*(type: boolean)*: True if the scan was accepted into the mean, False if it was rejected.
+        """
+        arr = np.asarray(arr, dtype=np.float64)
+        if self.mean is None:
+            self.mean = arr.copy()
+            self.count = 1
+            if self.track_variance:
+                self._m2 = np.zeros_like(self.mean)
+            return True
+        position = self.pushed
+        self.pushed += 1
+        # The new mean would be mean + delta / (count + 1), so the change it makes to the mean is delta / (count + 1).
+        delta = arr - self.mean
+        new_count = self.count + 1
+        diff = np.var(delta) / (new_count ** 2)
+        self._diffs.append(diff)
+        if len(self._diffs) > 2 and self._diffs[-2] - self._diffs[-1] < JUMP_LIMIT:
+            # Rolling back: the mean was never touched, so only the difference needs to be dropped.
+            self._diffs.pop()
+            return False
+        self.mean += delta / new_count
+        if self._m2 is not None:
+            # Welford update, using the deviation from both the old and the new mean.
+            self._m2 += delta * (arr - self.mean)
+        self.count = new_count
+        self.indices.append(position)
+        return True
+
+    @property
+    def diff_list(self):
+        """The differences of the accepted scans, with NaN and infinity values dealt with."""
+        return np.nan_to_num(np.array(self._diffs))
+
+    @property
+    def variance(self):
+        """The per-point population variance across the accepted scans."""
+        if not self.track_variance:
+            raise ValueError("The accumulator was created without track_variance, so no variance is available.")
+        if self._m2 is None:
+            return None
+        return self._m2 / self.count
+
+    def result(self):
+        """Returns the diff_list and indices in the form returned by interpolating_data."""
+        return self.diff_list, list(self.indices)
+
+
+def accumulate_scans(sdd_arrays):
+    """
+    ### Description:
+    -----
+        Feeds the sdd arrays of a sample's scans through a ScanAccumulator, one at a time.
+    ### Args:
+    -----
+        > **sdd_arrays** *(type: iterable of numpy arrays)* -- The sdd values of each scan, in scan order. A generator
+            can be passed, in which case only one scan is held in memory at a time.
+    ### Returns:
+    -----
+        >*(type: tuple)*: The diff_list (numpy array) and the indices (list of ints) of the accepted scans.
+    """
+    accumulator = ScanAccumulator()
+    for arr in sdd_arrays:
+        accumulator.push(arr)
+    if accumulator.mean is None:
+        raise ValueError("At least one scan is required to calculate differences between scans.")
+    return accumulator.result()
+
+
+def rolling_mean(values, window):
+    """
+    ### Description:
+    -----
+        Means of every run of window consecutive values, calculated in one call.
+    ### Args:
+    -----
+        > **values** *(type: list or numpy array of floats)* -- The values to slide the window over. If it has more than
+            one dimension, the window slides along the last axis.
+        > **window** *(type: int)* -- The number of consecutive values in each window.
+    ### Returns:
+    -----
+        >*(type: numpy array)*: One mean per window position, so len(values) - window + 1 values. Empty if there are
+            fewer values than the window needs.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1] < window:
+        return np.empty(values.shape[:-1] + (0,))
+    return np.lib.stride_tricks.sliding_window_view(values, window, axis=-1).mean(axis=-1)
+
+
+def rolling_variance(values, window):
+    """
+    ### Description:
+    -----
+        Population variances of every run of window consecutive values, calculated in one call. Each variance is the
+        average squared distance of the window's values from the window's mean.
+    ### Args:
+    -----
+        > **values** *(type: list or numpy array of floats)* -- The values to slide the window over. If it has more than
+            one dimension, the window slides along the last axis.
+        > **window** *(type: int)* -- The number of consecutive values in each window.
+    ### Returns:
+    -----
+        >*(type: numpy array)*: One variance per window position, so len(values) - window + 1 values. Empty if there
+            are fewer values than the window needs.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1] < window:
+        return np.empty(values.shape[:-1] + (0,))
+    return np.lib.stride_tricks.sliding_window_view(values, window, axis=-1).var(axis=-1)
+
+
+class RollingVariance:
+    """
+    ### Description:
+    -----
+        A fixed-length window of values whose mean and population variance are kept up to date as values are pushed
+        in, each push dropping the oldest value. Each push costs the same no matter how long the window is.
+    ### Args:
+    -----
+        > **seed** *(type: list or numpy array of floats)* -- The values the window starts with. The window keeps this
+            length for as long as it is used.
+    """
+    __slots__ = ('_buffer', '_start', '_mean', '_m2')
+
+    def __init__(self, seed):
+        self._buffer = np.array(seed, dtype=np.float64)
+        if len(self._buffer) == 0:
+            raise ValueError("A rolling window needs at least one value to start with.")
+        self._start = 0
+        self._mean = float(np.mean(self._buffer))
+        self._m2 = float(np.sum((self._buffer - self._mean) ** 2))
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def push(self, value):
+        """Drops the oldest value from the window, adds value, and returns the new variance."""
+        old = self._buffer[self._start]
+        self._buffer[self._start] = value
+        self._start = (self._start + 1) % len(self._buffer)
+        old_mean = self._mean
+        self._mean = old_mean + (value - old) / len(self._buffer)
+        self._m2 = max(self._m2 + (value - old) * (value - self._mean + old - old_mean), 0.0)
+        return self.variance
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        return self._m2 / len(self._buffer)
+
+
+def first_at_or_below(series, thresholds):
+    """
+    ### Description:
+    -----
+        Finds where a series first falls to each of a set of thresholds, for all the thresholds at once. The running
+        minimum of the series never increases, so each threshold is found with a binary search rather than a scan.
+    ### Args:
+    -----
+        > **series** *(type: numpy array of floats)* -- The values to search, in order.
+        > **thresholds** *(type: float or numpy array of floats)* -- The thresholds to search for.
+    ### Returns:
+    -----
+        >*(type: numpy array of ints)*: For each threshold, the position of the first value at or below it, or -1 if
+            the series never gets that low.
+    """
+    running = np.fmin.accumulate(np.asarray(series, dtype=np.float64))
+    found = np.searchsorted(-running, -np.asarray(thresholds, dtype=np.float64), side='left')
+    return np.where(found < len(running), found, -1)
@@ -0,0 +1,184 @@
+"""
+### Overview: Puts error bars on the number of additional scans predict_num_scans reports. The differences between the
+initial scans are noisy, so the noise model fitted to them, the cut-off worked out from them, and the number of scans
+they give, could easily have come out differently. Here the fitted model's residuals are resampled thousands of times
+to make replicate sets of differences, the model is refitted to every replicate at once, and every replicate's cut-off
+and forecast are searched at once, all as NumPy arrays of shape replicates x scans. The spread of the results gives a
+confidence interval for the number of scans. The same can be done for determine_num_scans' variance rule.###
+"""
+import numpy as np
+
+from predict_num_scans import (DEFAULT_DESIRED_DIFFERENCE, MAX_PREDICTIONS, additional_scans, check_sample_fitness,
+                               fit_noise_decay, noise, validate_scan_files)
+from scan_stats import accumulate_scans, rolling_mean, rolling_variance
+
+# The percentiles reported if none are asked for.
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _batch_fit(replicates, basis):
+    # With shift held at its fitted value, the noise model is a straight line in (idx + shift) ** (-3 / 2), so every
+    # replicate's amp and ofs can be found by least squares with a single matrix product.
+    design = np.column_stack((basis, np.ones_like(basis)))
+    amp, ofs = np.linalg.pinv(design) @ replicates.T
+    # Keeping amp and ofs within the same bounds fit_noise_decay uses. Where the best line breaks one of them, the best
+    # fit within the bounds has amp or ofs at 0 and the other refitted with it fixed there, so both are tried and the
+    # closer one kept.
+    inside = (amp >= 0) & (ofs >= 0)
+    if not inside.all():
+        amp_only = np.maximum(replicates @ basis / (basis @ basis), 0)
+        ofs_only = np.maximum(replicates.mean(axis=1), 0)
+        amp_error = ((replicates - amp_only[:, None] * basis) ** 2).sum(axis=1)
+        ofs_error = ((replicates - ofs_only[:, None]) ** 2).sum(axis=1)
+        use_amp = amp_error <= ofs_error
+        amp = np.where(inside, amp, np.where(use_amp, amp_only, 0))
+        ofs = np.where(inside, ofs, np.where(use_amp, 0, ofs_only))
+    return amp, ofs
+
+
+def _replicate(d_list, indices, replicates, seed, horizon):
+    # Makes the replicate sets of differences, and forecasts the next horizon noise levels of each.
+    idx = np.asarray(indices[:len(d_list)], dtype=np.float64)
+    params = fit_noise_decay(d_list, indices).valuesdict()
+    fitted = noise(idx, **params)
+    residuals = d_list - fitted
+
+    # Every replicate is the fitted model plus a resampling of its residuals.
+    rng = np.random.default_rng(seed)
+    samples = fitted + rng.choice(residuals, size=(replicates, len(d_list)), replace=True)
+    amp, ofs = _batch_fit(samples, (idx + params['shift']) ** (-3 / 2))
+    future = int(indices[-1]) + np.arange(1, horizon + 1, dtype=np.float64)
+    forecasts = amp[:, None] * ((future + params['shift']) ** (-3 / 2))[None, :] + ofs[:, None]
+    return samples, forecasts
+
+
+def _spread(values, converged, percentiles):
+    done = values[converged]
+    return {
+        'median': float(np.median(done)) if done.size else np.nan,
+        'percentiles': {p: float(v) for p, v in zip(percentiles, np.percentile(done, percentiles))}
+        if done.size else {p: np.nan for p in percentiles},
+        'non_converged': float(1 - converged.mean()),
+    }
+
+
+def monte_carlo_num_scans(d_list, indices, percent_of_log=0.4, num_scans=None, replicates=10000,
+                          percentiles=DEFAULT_PERCENTILES, seed=None, window=10):
+    """
+    ### Description:
+    -----
+        Finds the spread of the number of additional scans predict_num_scans would report, over replicate sets of
+        differences made by resampling the residuals of the noise model fitted to d_list. Each replicate goes through
+        the same steps as the prediction: its cut-off is worked out from its own differences as predict_cut_off does,
+        and its differences followed by its forecast are searched for the cut-off as find_cut_off does.
+    ### Args:
+    -----
+        > **d_list** *(type: list of floats)* -- The differences between the sample's scans.
+        > **indices** *(type: list of ints)* -- The scan numbers of the scans used to generate d_list.
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **num_scans** *(type: optional int)* -- The number of scans the prediction is made from, so only the first
+            num_scans - 1 differences are used. Default is every difference in d_list.
+        > **replicates** *(type: optional int)* -- Default value is 10000. The number of replicate sets of differences.
+        > **percentiles** *(type: optional list of floats)* -- Default value is DEFAULT_PERCENTILES. The percentiles of
+            the number of additional scans to report.
+        > **seed** *(type: optional int)* -- The seed for the resampling, so the same result can be made again.
+        > **window** *(type: optional int)* -- Default value is 10. See find_cut_off.
+    ### Returns:
+    -----
+        >*(type: dict)*: With the keys:
+            'median' -- the median number of additional scans, over the replicates that reached their cut-off.
+            'percentiles' -- a dict of the number of additional scans at each of the percentiles asked for, over the
+                same replicates.
+            'non_converged' -- the fraction of the replicates that never reached their cut-off within MAX_PREDICTIONS
+                predicted scans.
+            'additional_scans' -- the number of additional scans for every replicate, as a numpy array, NaN where the
+                cut-off was never reached.
+    """
+    if num_scans is None:
+        num_scans = len(d_list) + 1
+    d_list = np.asarray(d_list[: num_scans - 1], dtype=np.float64)
+    indices = list(indices[: num_scans - 1])
+    samples, forecasts = _replicate(d_list, indices, replicates, seed, MAX_PREDICTIONS)
+
+    # A replicate whose differences don't average above 0 has no cut-off, as predict_cut_off would raise for it.
+    averages = samples.mean(axis=1)
+    cut_offs = np.full(replicates, -np.inf)
+    positive = averages > 0
+    cut_offs[positive] = np.exp(percent_of_log * np.log(averages[positive]))
+
+    reached = rolling_mean(np.concatenate((samples, forecasts), axis=1), window) <= cut_offs[:, None]
+    converged = reached.any(axis=1)
+    # As in find_cut_off, the window starting at difference k reaches the cut-off at scan k + window + 1.
+    cut_off_scan = np.argmax(reached, axis=1) + window + 1
+    scans = np.where(converged, additional_scans(cut_off_scan, num_scans), np.nan)
+
+    result = _spread(scans, converged, percentiles)
+    result['additional_scans'] = scans
+    return result
+
+
+def monte_carlo_num_predictions(d_list, indices, desired_difference=DEFAULT_DESIRED_DIFFERENCE, replicates=10000,
+                                percentiles=DEFAULT_PERCENTILES, seed=None):
+    """
+    ### Description:
+    -----
+        Finds the spread of the number of predictions determine_num_scans would make, over replicate sets of
+        differences made by resampling the residuals of the noise model fitted to d_list.
+    ### Args:
+    -----
+        > **d_list** *(type: list of floats)* -- The differences between the sample's initial scans.
+        > **indices** *(type: list of ints)* -- The scan numbers of the scans used to generate d_list.
+        > **desired_difference** *(type: optional float)* -- Default value is DEFAULT_DESIRED_DIFFERENCE. See
+            determine_num_scans.
+        > **replicates**, **percentiles**, **seed** -- See monte_carlo_num_scans.
+    ### Returns:
+    -----
+        >*(type: dict)*: 'median', 'percentiles' and 'non_converged' as for monte_carlo_num_scans, but of the number
+            of predictions determine_num_scans returns, and 'num_predictions' for every replicate, as a numpy array,
+            NaN where desired_difference was never reached.
+    """
+    d_list = np.asarray(d_list, dtype=np.float64)
+    samples, forecasts = _replicate(d_list, indices, replicates, seed, MAX_PREDICTIONS - 9)
+
+    # The same window determine_num_scans uses: the first 5 differences followed by the first 6.
+    recent_differences = np.concatenate((samples[:, :5], samples[:, :6]), axis=1)
+    variances = rolling_variance(np.concatenate((recent_differences, forecasts), axis=1),
+                                 recent_differences.shape[1])
+    reached = variances <= desired_difference
+    if len(d_list) <= 5:
+        reached[:, 0] = False
+    first = np.argmax(reached, axis=1)
+    converged = reached.any(axis=1)
+    num_predictions = np.where(converged, np.where(first == 0, 0, 9 + first), np.nan)
+
+    result = _spread(num_predictions, converged, percentiles)
+    result['num_predictions'] = num_predictions
+    return result
+
+
+def num_scans_uncertainty(data, num_scans=10, percent_of_log=0.4, replicates=10000, percentiles=DEFAULT_PERCENTILES,
+                          seed=None, cache=True, engine='sgmdata'):
+    """
+    ### Description:
+    -----
+        Loads and interpolates a sample's scans, and returns the spread of the number of additional scans needed, as
+        found by monte_carlo_num_scans.
+    ### Args:
+    -----
+        > **data** *(type: list of str)* -- The hdf5 files of the sample.
+        > **num_scans** *(type: optional int)* -- Default value is 10. See predict_num_scans.
+        > **percent_of_log** *(type: optional float)* -- Default value is 0.4. See predict_num_scans.
+        > **replicates**, **percentiles**, **seed** -- See monte_carlo_num_scans.
+        > **cache** *(type: optional InterpolationCache or boolean)* -- Default value is True. See check_sample_fitness.
+        > **engine** *(type: optional str)* -- Default value is "sgmdata". See check_sample_fitness.
+    ### Returns:
+    -----
+        >*(type: dict)*: As returned by monte_carlo_num_scans, with the 'sample' added.
+    """
+    report = validate_scan_files(data)
+    num_scans = min(num_scans, len(report['scans']))
+    stack = check_sample_fitness(data, num_scans, report=report, cache=cache, engine=engine)
+    diff_list, indices = accumulate_scans(stack.sdd())
+    result = monte_carlo_num_scans(diff_list, indices, percent_of_log, num_scans, replicates, percentiles, seed)
+    result['sample'] = report['sample']
+    return result
@@ -0,0 +1,121 @@
+"""
+### Overview: Writes synthetic SGM-style hdf5 files, for trying out and benchmarking the prediction tools without
+beamline data. Each scan entry holds an energy axis, a sample name and sdd signals made up of a few absorption peaks
+plus random noise. How the noise changes from scan to scan can be set, and outlier scans with much more noise than the
+rest can be mixed in, to exercise the jump rule in the running mean.###
+"""
+import os
+
+import h5py
+import numpy as np
+
+# The absorption peaks the synthetic spectrum is made of, as (energy, width, height).
+PEAKS = ((285.0, 0.6, 1.0), (287.5, 0.8, 0.5), (293.0, 2.5, 0.7))
+
+# How the noise of each scan compares to the noise of the first, by the scan's number counting from 0.
+NOISE_PROFILES = {
+    'constant': lambda i: 1.0,
+    # The beam settling down, so later scans are a little quieter.
+    'decay': lambda i: 0.5 + 0.5 / np.sqrt(i + 1),
+    # The beam or the sample degrading, so later scans are a little noisier.
+    'drift': lambda i: 1.0 + 0.02 * i,
+}
+
+
+def synthetic_spectrum(energy):
+    """Returns the noiseless spectrum of the synthetic sample at each energy."""
+    spectrum = 0.1 + 0.2 / (1 + np.exp(-(energy - 290.0)))
+    for centre, width, height in PEAKS:
+        spectrum = spectrum + height * np.exp(-0.5 * ((energy - centre) / width) ** 2)
+    return spectrum
+
+
+def write_scan(h5, entry, sample, rng, num_points=500, num_channels=4, num_bins=16, noise=0.2, start=270.0,
+               stop=320.0):
+    """
+    Purpose: Writes one synthetic scan entry into an open hdf5 file.
+    Parameters:
+        h5(h5py File): the file to write into.
+        entry(str): the name of the scan entry, eg. "entry1".
+        sample(str): the name of the sample the scan is from.
+        rng(numpy Generator): the random number generator the noise is drawn from.
+        num_points(optional int): the number of energy points in the scan. Default value is 500.
+        num_channels(optional int): the number of sdd signals, named sdd1, sdd2, etc. Default value is 4.
+        num_bins(optional int): the number of bins in each sdd signal. Default value is 16.
+        noise(optional float): the standard deviation of the noise, relative to the spectrum. Default value is 0.2.
+        start(optional float): the energy the scan starts at. Default value is 270.
+        stop(optional float): the energy the scan stops at. Default value is 320.
+    """
+    group = h5.create_group(entry)
+    group.attrs['NX_class'] = 'NXentry'
+    group.create_dataset('sample/name', data=sample)
+    data = group.create_group('data')
+    data.attrs['NX_class'] = 'NXdata'
+    # The monochromator never lands exactly on the same energies twice.
+    energy = np.sort(rng.uniform(start, stop, num_points))
+    data.create_dataset('en', data=energy)
+    spectrum = synthetic_spectrum(energy)[:, None] * np.linspace(1.0, 0.5, num_bins)[None, :]
+    for channel in range(1, num_channels + 1):
+        counts = 100 * spectrum * (1 + noise * rng.standard_normal(spectrum.shape))
+        data.create_dataset('sdd{}'.format(channel), data=counts)
+
+
+def write_scan_file(filename, num_scans, sample="Synthetic - C", seed=None, first_entry=1, noise=0.2,
+                    noise_profile='constant', outliers=(), outlier_scale=20.0, **kwargs):
+    """
+    Purpose: Writes an hdf5 file of synthetic scans from one sample.
+    Parameters:
+        filename(str): the file to write. Scans are added to it if it already exists.
+        num_scans(int): the number of scan entries to write.
+        sample(optional str): the name of the sample. Default value is "Synthetic - C".
+        seed(optional int): the seed for the noise, so the same file can be written again.
+        first_entry(optional int): the number of the first entry written. Default value is 1.
+        noise(optional float): the noise of the first scan, relative to the spectrum. Default value is 0.2.
+        noise_profile(optional str or function): how the noise changes from scan to scan. One of the NOISE_PROFILES,
+        or a function taking the scan's number (counting from 0) and returning its noise relative to the first scan.
+        Default is "constant".
+        outliers(optional list of ints): the numbers of the scans (counting from 0) to make outliers.
+        outlier_scale(optional float): how many times noisier than the rest outlier scans are. Default value is 20.
+        **kwargs: passed on to write_scan.
+    Returns:
+        filename(str): the file that was written.
+    """
+    profile = NOISE_PROFILES[noise_profile] if isinstance(noise_profile, str) else noise_profile
+    outliers = set(outliers)
+    rng = np.random.default_rng(seed)
+    with h5py.File(filename, 'a') as h5:
+        for i in range(num_scans):
+            scan_noise = noise * profile(i) * (outlier_scale if i in outliers else 1.0)
+            write_scan(h5, 'entry{}'.format(first_entry + i), sample, rng, noise=scan_noise, **kwargs)
+    return filename
+
+
+def write_sample(directory, num_scans, scans_per_file=10, sample="Synthetic - C", seed=None,
+                 noise_profile='constant', outliers=(), **kwargs):
+    """
+    Purpose: Writes a sample's synthetic scans into a directory, spread over several files the way a beamline would
+    write them.
+    Parameters:
+        directory(str): the directory to write the files into. It must already exist.
+        num_scans(int): the number of scans to write.
+        scans_per_file(optional int): the most scans written into one file. Default value is 10.
+        sample(optional str): the name of the sample. Default value is "Synthetic - C".
+        seed(optional int): the seed for the noise, so the same files can be written again.
+        noise_profile(optional str or function): see write_scan_file. Scans are numbered across all the files.
+        outliers(optional list of ints): the numbers of the scans (counting from 0, across all the files) to make
+        outliers.
+        **kwargs: passed on to write_scan_file.
+    Returns:
+        files(list of str): the files that were written, in order.
+    """
+    profile = NOISE_PROFILES[noise_profile] if isinstance(noise_profile, str) else noise_profile
+    starts = range(0, num_scans, scans_per_file)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    files = []
+    for n, first in enumerate(starts):
+        count = min(scans_per_file, num_scans - first)
+        filename = os.path.join(directory, 'scan_{:05d}.hdf5'.format(n + 1))
+        write_scan_file(filename, count, sample, seeds[n], noise_profile=lambda i, first=first: profile(first + i),
+                        outliers=[i - first for i in outliers if first <= i < first + count], **kwargs)
+        files.append(filename)
+    return files
@@ -0,0 +1,60 @@
+"""
+### Overview: Checks the single-fit forecast used by determine_num_scans against the loop it replaced, which refitted
+the noise model after every predicted scan.###
+"""
+import numpy as np
+import pytest
+
+from predict_num_scans import determine_num_scans, fit_noise_decay, forecast_noise, noise
+
+
+def _refit_predict(d_list, indices):
+    # The old predict(): fits the noise model to every difference so far and predicts the next scan's noise level.
+    params = fit_noise_decay(d_list, indices)
+    return noise(np.float64(indices[-1] + 1), **params.valuesdict())
+
+
+def _refit_determine_num_scans(d_list, indices, desired_difference):
+    # The loop determine_num_scans used before the single-fit forecast, refitting after every prediction.
+    copied_indices = list(indices)
+    d_list = list(d_list)
+    num_predictions = 9
+    recent_differences = d_list[:5] + d_list[:6]
+    if np.var(recent_differences) <= desired_difference:
+        return 0
+    while True:
+        predicted_level = _refit_predict(d_list, copied_indices)
+        copied_indices.append(int(copied_indices[-1]) + 1)
+        num_predictions += 1
+        d_list.append(predicted_level)
+        recent_differences.pop(0)
+        recent_differences.append(predicted_level)
+        if np.var(recent_differences) <= desired_difference:
+            return num_predictions
+        if num_predictions > 60:
+            raise ValueError("Desired level of variance cannot be reached.")
+
+
+def _differences(seed, amp=40.0, shift=0.5, ofs=0.2, count=9):
+    rng = np.random.default_rng(seed)
+    indices = list(range(count))
+    levels = noise(np.arange(count, dtype=np.float64), amp, shift, ofs)
+    return list(levels * (1 + 0.1 * rng.standard_normal(count))), indices
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_forecast_matches_refitting_every_scan(seed):
+    d_list, indices = _differences(seed)
+    forecast = forecast_noise(d_list, indices, 15)
+    refitted = []
+    for _ in range(15):
+        refitted.append(_refit_predict(d_list + refitted, list(range(len(d_list) + len(refitted)))))
+    np.testing.assert_allclose(forecast, refitted, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('desired_difference', [0.5, 5.0, 50.0, 1e6])
+def test_determine_num_scans_matches_refitting_every_scan(seed, desired_difference):
+    d_list, indices = _differences(seed)
+    expected = _refit_determine_num_scans(d_list, indices, desired_difference)
+    assert determine_num_scans(d_list, indices, desired_difference) == expected
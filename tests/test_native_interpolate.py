@@ -0,0 +1,52 @@
+"""
+### Overview: Checks native_interpolate against SGMData.interpolate on a small synthetic file, and the binning of points
+against a fixed energy grid.###
+"""
+import numpy as np
+import pytest
+
+from native_interpolate import bin_scan, interpolate_scans
+from scan_metadata import read_scan_metadata
+from synthetic_scans import synthetic_spectrum, write_scan_file
+
+
+def test_matches_sgmdata_interpolate(tmp_path):
+    sgmdata_load = pytest.importorskip('sgmdata.load')
+    # Enough points that nearly every bin gets one, and no noise, so both interpolations should land on the spectrum.
+    filename = write_scan_file(str(tmp_path / 'scans.hdf5'), 2, seed=0, noise=0.0, num_points=5000, num_channels=2,
+                               num_bins=4)
+    expected = sgmdata_load.SGMData([filename]).interpolate(resolution=0.1)
+    report = read_scan_metadata([filename])
+    stack = interpolate_scans(report['scans'], report['sdd'], resolution=0.1,
+                              grid=np.asarray(expected[0].index, dtype=np.float64))
+    for frame, result in zip(expected, stack.to_frames()):
+        columns = [name for name in frame.columns if name.startswith('sdd')]
+        assert sorted(columns) == sorted(result.columns)
+        # The ends are left out, as the two may treat the part filled bins at the edges of the scan differently.
+        np.testing.assert_allclose(result[columns].to_numpy()[5:-5], frame[columns].to_numpy()[5:-5], rtol=0.02)
+
+
+def test_bin_scan_averages_each_bin():
+    grid = np.arange(270.0, 280.0, 0.5)
+    energy = np.repeat(grid, 3) + np.tile([-0.2, 0.0, 0.2], len(grid))
+    values = synthetic_spectrum(energy)[:, None] * np.array([1.0, 2.0])
+    out = bin_scan(energy, values, grid)
+    expected = values.reshape(len(grid), 3, 2).mean(axis=1)
+    np.testing.assert_allclose(out, expected)
+
+
+def test_bin_scan_drops_points_outside_a_fixed_grid():
+    grid = np.arange(10.0)
+    energy = np.array([-3.0, -1.0, 0.2, 2.0, 9.0, 9.4, 12.0])
+    values = np.array([100.0, 100.0, 1.0, 3.0, 5.0, 7.0, 100.0])[:, None]
+    out = bin_scan(energy, values, grid)[:, 0]
+    assert out[0] == 1.0
+    assert out[9] == 6.0
+    np.testing.assert_allclose(out[1], 2.0)
+    assert np.all(out <= 6.0)
+
+
+def test_bin_scan_with_no_points_inside_the_grid():
+    out = bin_scan(np.array([20.0, 21.0]), np.ones((2, 3)), np.arange(10.0))
+    assert out.shape == (10, 3)
+    assert np.isnan(out).all()
@@ -0,0 +1,75 @@
+"""
+### Overview: Checks the running mean in scan_stats against the interpolating_data it replaced, which re-averaged every
+scan so far each time a scan was added, including the rule that leaves out scans whose variance jumps by more than
+50.###
+"""
+import numpy as np
+import pytest
+
+from scan_stack import ScanStack
+from scan_stats import ScanAccumulator, accumulate_scans
+
+
+def _old_interpolating_data(sdd_list):
+    # interpolating_data as it was, starting from the sdd arrays rather than the dataframes they were taken from.
+    prev_mean = sdd_list[0]
+    avg_list = [sdd_list[0]]
+    diff_list = []
+    indices = []
+    for i, arr in enumerate(sdd_list[1:]):
+        avg_list.append(arr)
+        cur_mean = np.mean(avg_list, axis=0)
+        diff_list.append(np.var(np.subtract(cur_mean, prev_mean)))
+        if len(diff_list) > 2:
+            if diff_list[-2] - diff_list[-1] < -50:
+                avg_list = avg_list[:-1]
+                diff_list = diff_list[:-1]
+            else:
+                indices.append(i)
+                prev_mean = cur_mean
+        else:
+            indices.append(i)
+            prev_mean = cur_mean
+    diff_list = np.nan_to_num(np.array(diff_list))
+    return diff_list, indices
+
+
+def _scans(seed, count=20, outliers=(), scale=1.0):
+    rng = np.random.default_rng(seed)
+    spectrum = np.sin(np.linspace(0, 6, 120))[:, None] * np.linspace(1, 2, 8)[None, :] * 100
+    scans = [spectrum + scale * rng.standard_normal(spectrum.shape) for _ in range(count)]
+    for i in outliers:
+        scans[i] = spectrum + 1000 * rng.standard_normal(spectrum.shape)
+    return scans
+
+
+@pytest.mark.parametrize('outliers', [(), (5,), (4, 11), (3, 4, 15), (1,)])
+def test_matches_old_interpolating_data(outliers):
+    scans = _scans(len(outliers), outliers=outliers)
+    expected_diffs, expected_indices = _old_interpolating_data(scans)
+    diff_list, indices = accumulate_scans(scans)
+    np.testing.assert_allclose(diff_list, expected_diffs, rtol=1e-9)
+    assert indices == expected_indices
+
+
+def test_jump_rule_leaves_outliers_out_of_the_mean():
+    scans = _scans(0, outliers=(6, 12))
+    accumulator = ScanAccumulator()
+    accepted = [accumulator.push(scan) for scan in scans]
+    expected_diffs, expected_indices = _old_interpolating_data(scans)
+    # Both outliers are past the first two differences, where the rule applies, and jump by far more than 50.
+    assert not accepted[6] and not accepted[12]
+    assert accepted.count(False) == len(scans) - 1 - len(expected_indices)
+    kept = [scan for scan, ok in zip(scans, accepted) if ok]
+    np.testing.assert_allclose(accumulator.mean, np.mean(kept, axis=0))
+    np.testing.assert_allclose(accumulator.diff_list, expected_diffs, rtol=1e-9)
+
+
+def test_nan_differences_become_zero():
+    scans = _scans(1, count=6)
+    scans[3] = np.full_like(scans[3], np.nan)
+    expected_diffs, expected_indices = _old_interpolating_data(scans)
+    diff_list, indices = accumulate_scans(ScanStack(np.array(scans), np.arange(120.0), ['sdd'] * 8).sdd())
+    np.testing.assert_allclose(diff_list, expected_diffs, rtol=1e-9)
+    assert indices == expected_indices
+    assert not np.isnan(diff_list).any()